@@ -3,64 +3,374 @@ import os
 import sys
 import subprocess
 from pathlib import Path
+import numpy as np
 import pandas as pd
-import glob
 
-# Import functions from other scripts if possible, else use subprocess
+from table_io import TableWriter, read_table, write_table
+from manifest import Manifest
+from ZipStrippor import (COMPACT_DTYPE, SHARD_FORMATS, iter_station_frames, iter_zip_frames, process_zip_files,
+                         processed_shards, shard_path, shard_version, stale_zip_files)
+from conversion_functions import apply_teos10
 
-def run_zipstrippor(data_folder, output_folder):
+# The pipeline runs in-process by default (run_pipeline); the subprocess runners below
+# are used with --subprocess
+
+def run_zipstrippor(data_folder, output_folder, workers=1, station_workers=1, output_format='csv',
+                    incremental=False, compact=False):
     """Run ZipStrippor.py as a subprocess."""
     cmd = [sys.executable, os.path.join(os.path.dirname(__file__), 'ZipStrippor.py'),
-           '--data_folder', data_folder, '--output_folder', output_folder]
+           '--data_folder', data_folder, '--output_folder', output_folder,
+           '--workers', str(workers), '--station_workers', str(station_workers),
+           '--output_format', output_format]
+    if incremental:
+        cmd.append('--incremental')
+    if compact:
+        cmd.append('--compact')
     result = subprocess.run(cmd, check=True)
     print(f"ZipStrippor finished. Output folder: {output_folder}")
 
 
-def run_aggregator(input_folder, output_csv):
-    """Aggregate processed CSVs into one file."""
-    main_rows = []
-    csv_files = glob.glob(os.path.join(input_folder, '*.csv'))
-    for csv_file in csv_files:
-        df = pd.read_csv(csv_file)
-        # Group by unique latitude, calculate mean of CTDPRS, CTDTMP, CTDSAL
-        grouped = df.groupby('LATITUDE').agg({
-            'LONGITUDE': 'first',
-            'CTDPRS': 'mean',
-            'CTDTMP': 'mean',
-            'CTDSAL': 'mean'
-        }).reset_index()
-        grouped = grouped[['LATITUDE', 'LONGITUDE', 'CTDPRS', 'CTDTMP', 'CTDSAL']]
-        main_rows.append(grouped)
-    if main_rows:
-        main_df = pd.concat(main_rows, ignore_index=True)
-        main_df.to_csv(output_csv, index=False)
+AGGREGATED_COLUMNS = ['LATITUDE', 'LONGITUDE', 'CTDPRS', 'CTDTMP', 'CTDSAL']
+
+
+# Grouping keys understood by aggregate_frames()
+GROUP_KEYS = ('CRUISE', 'LATITUDE', 'LONGITUDE', 'PRS_BIN')
+# One row per (zip, latitude): the same rows as grouping every shard by latitude on its own
+DEFAULT_GROUP_KEYS = ('CRUISE', 'LATITUDE')
+
+
+def aggregate_frames(frames, group_keys=DEFAULT_GROUP_KEYS, pressure_bin=None):
+    """
+    Aggregate processed shards with a single vectorized group-by over all of them.
+    frames is an iterable of DataFrames (one per zip / shard, in order). group_keys is any
+    combination of:
+        CRUISE    - the shard a row came from
+        LATITUDE, LONGITUDE
+        PRS_BIN   - CTDPRS floored to a multiple of pressure_bin (dbar)
+    Non-key columns are averaged (LATITUDE / LONGITUDE take the group's first value).
+    Returns a DataFrame with AGGREGATED_COLUMNS, or None if there are no frames.
+    """
+    unknown = set(group_keys) - set(GROUP_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown group keys {sorted(unknown)}, expected a subset of {GROUP_KEYS}")
+    if 'PRS_BIN' in group_keys and not pressure_bin:
+        raise ValueError("Grouping by PRS_BIN needs a pressure_bin width in dbar")
+
+    parts = []
+    cruise = []
+    for i, df in enumerate(frames):
+        parts.append(df[AGGREGATED_COLUMNS])
+        cruise.append(np.full(len(df), i, dtype=np.int32))
+    if not parts:
+        return None
+
+    df = pd.concat(parts, ignore_index=True)
+    if 'CRUISE' in group_keys:
+        df['CRUISE'] = np.concatenate(cruise)
+    if 'PRS_BIN' in group_keys:
+        df = with_pressure_bin(df, pressure_bin)
+
+    grouped = df.groupby(list(group_keys), sort=True).agg(aggregation_spec(group_keys)).reset_index()
+    return grouped[AGGREGATED_COLUMNS]
+
+
+def with_pressure_bin(df, pressure_bin):
+    """Add the PRS_BIN group key: CTDPRS floored to a multiple of pressure_bin."""
+    return df.assign(PRS_BIN=np.floor(df['CTDPRS'].to_numpy() / pressure_bin) * pressure_bin)
+
+
+def aggregation_spec(group_keys):
+    """{column: 'first' / 'mean'} for the non-key columns of aggregate_frames()."""
+    agg = {'LATITUDE': 'first', 'LONGITUDE': 'first', 'CTDPRS': 'mean', 'CTDTMP': 'mean', 'CTDSAL': 'mean'}
+    return {col: how for col, how in agg.items() if col not in group_keys}
+
+
+def aggregate_frame(df):
+    """Group one processed shard by unique latitude, calculate mean of CTDPRS, CTDTMP, CTDSAL.
+    aggregate_frames() does this for all shards at once."""
+    grouped = df.groupby('LATITUDE').agg({
+        'LONGITUDE': 'first',
+        'CTDPRS': 'mean',
+        'CTDTMP': 'mean',
+        'CTDSAL': 'mean'
+    }).reset_index()
+    return grouped[AGGREGATED_COLUMNS]
+
+
+def partial_aggregate(df):
+    """
+    Per-latitude sums, non-NaN counts and first longitude of one station frame.
+    combine_partials() merges these into the same table aggregate_frame() gives for the
+    whole zip, so a zip can be aggregated one station at a time.
+    """
+    grouped = df.groupby('LATITUDE')
+    value_cols = AGGREGATED_COLUMNS[2:]
+    part = grouped[value_cols].sum()
+    counts = grouped[value_cols].count()
+    part[[f'{col}_n' for col in value_cols]] = counts.to_numpy()
+    part['LONGITUDE'] = grouped['LONGITUDE'].first()
+    return part
+
+
+def combine_partials(parts):
+    """Merge partial_aggregate() outputs of one zip into the aggregate_frame() layout."""
+    value_cols = AGGREGATED_COLUMNS[2:]
+    parts = pd.concat(parts)
+    grouped = parts.groupby(level=0)
+    sums = grouped.sum()
+    # LONGITUDE is 'first', not summed
+    out = pd.DataFrame({'LONGITUDE': grouped['LONGITUDE'].first()})
+    for col in value_cols:
+        # Mean over non-NaN values, NaN where a latitude has none (as groupby().mean())
+        # (in the values' dtype: the counts would otherwise promote float32 sums to float64)
+        out[col] = (sums[col] / sums[f'{col}_n'].where(sums[f'{col}_n'] > 0)).astype(sums[col].dtype)
+    out.index.name = 'LATITUDE'
+    return out.reset_index()[AGGREGATED_COLUMNS]
+
+
+def run_aggregator(input_folder, output_csv, group_keys=DEFAULT_GROUP_KEYS, pressure_bin=None,
+                   output_format='csv'):
+    """
+    Aggregate the processed shards of input_folder written in output_format
+    (<stem>_processed.csv or .parquet) into one file (format from output_csv's suffix).
+    """
+    csv_files = processed_shards(input_folder, output_format)
+    frames = (read_table(csv_file, columns=AGGREGATED_COLUMNS) for csv_file in csv_files)
+    main_df = aggregate_frames(frames, group_keys, pressure_bin)
+    if main_df is not None:
+        write_table(main_df, output_csv)
         print(f"Aggregator finished. Output CSV: {output_csv}")
     else:
         print("No CSV files found or processed.")
 
 
-def run_conversion_functions(input_csv, output_csv):
+def run_conversion_functions(input_csv, output_csv, compact=False):
     """Run conversion_functions.py as a subprocess."""
     cmd = [sys.executable, os.path.join(os.path.dirname(__file__), 'conversion_functions.py'),
            input_csv, output_csv]
+    if compact:
+        cmd.append('--compact')
     result = subprocess.run(cmd, check=True)
     print(f"Conversion finished. Output CSV: {output_csv}")
 
 
+def run_incremental_zips(zip_folder, processed_folder, workers=1, station_workers=1, output_format='csv',
+                         dtype=np.float64):
+    """
+    Bring the shards in processed_folder up to date with the zips in zip_folder, parsing
+    only new or changed zips, and return {zip_file: shard DataFrame} in zip order.
+    """
+    zip_files = sorted(Path(zip_folder).glob("*.zip"))
+    manifest = Manifest(processed_folder, shard_version(dtype))
+    fingerprints = stale_zip_files(zip_files, processed_folder, output_format, manifest)
+
+    aggregated = {}
+    for zip_file, df in iter_zip_frames(zip_folder, workers, station_workers, zip_files=list(fingerprints),
+                                        dtype=dtype):
+        output_path = shard_path(zip_file, processed_folder, output_format)
+        write_table(df, output_path)
+        manifest.record(zip_file, output_path, fingerprints[zip_file])
+        aggregated[zip_file] = df[AGGREGATED_COLUMNS]
+    manifest.save()
+
+    for zip_file in zip_files:
+        output_path = shard_path(zip_file, processed_folder, output_format)
+        if zip_file not in aggregated and zip_file not in fingerprints and output_path.exists():
+            # CSV shards read back as float64
+            aggregated[zip_file] = read_table(output_path, columns=AGGREGATED_COLUMNS).astype(dtype)
+    return {zip_file: aggregated[zip_file] for zip_file in zip_files if zip_file in aggregated}
+
+
+def run_pipeline(zip_folder, processed_folder=None, aggregated_path=None, final_path=None,
+                 workers=1, station_workers=1, output_format='csv', incremental=False,
+                 group_keys=DEFAULT_GROUP_KEYS, pressure_bin=None, dtype=np.float64):
+    """
+    Run Zip -> Aggregate -> TEOS-10 in this process, passing DataFrames between the
+    stages instead of files. Intermediate files are only written when processed_folder /
+    aggregated_path are given, the final table only when final_path is given.
+    With incremental=True (needs processed_folder) only zips that are new or changed
+    since their shard was written are parsed; the other zips are read back from their
+    shards. group_keys / pressure_bin choose the aggregation, see aggregate_frames().
+    dtype=COMPACT_DTYPE keeps every stage in float32 (TEOS-10 maths still in float64).
+    Returns the final DataFrame (None if no zip produced data).
+    """
+    if processed_folder:
+        os.makedirs(processed_folder, exist_ok=True)
+
+    # Step 1: Unzip and process
+    if incremental:
+        if not processed_folder:
+            raise ValueError("incremental=True needs a processed_folder to keep the shards in")
+        frames = list(run_incremental_zips(zip_folder, processed_folder, workers, station_workers,
+                                           output_format, dtype).values())
+    else:
+        frames = []
+        for zip_file, df in iter_zip_frames(zip_folder, workers, station_workers, dtype=dtype):
+            if processed_folder:
+                write_table(df, shard_path(zip_file, processed_folder, output_format))
+            frames.append(df[AGGREGATED_COLUMNS])
+
+    # Step 2: Aggregate all zips in one group-by
+    main_df = aggregate_frames(frames, group_keys, pressure_bin)
+    del frames
+    if main_df is None:
+        print("No zip files found or processed.")
+        return None
+
+    if aggregated_path:
+        write_table(main_df, aggregated_path)
+        print(f"Aggregator finished. Output: {aggregated_path}")
+
+    # Step 3: TEOS-10 conversion
+    final_df = apply_teos10(main_df, dtype=dtype)
+    if final_path:
+        write_table(final_df, final_path)
+        print(f"Conversion finished. Output: {final_path}")
+    return final_df
+
+
+def run_streaming_pipeline(zip_folder, final_path, station_workers=1, chunk_size=1_000_000, dtype=np.float64):
+    """
+    Streaming variant of run_pipeline: stations are parsed one at a time and folded into
+    per-zip running aggregates; aggregated rows are run through apply_teos10 and appended
+    to final_path (CSV or Parquet) every chunk_size rows. Peak memory is bounded by the
+    chunk size and the stations in flight, not by the size of the dataset.
+    Returns the number of rows written.
+    """
+    buffer = []
+    buffered_rows = 0
+    current_zip = None
+    parts = []
+
+    with TableWriter(final_path) as out:
+        def flush():
+            nonlocal buffer, buffered_rows
+            if buffer:
+                out.write(apply_teos10(pd.concat(buffer, ignore_index=True), dtype=dtype))
+            buffer = []
+            buffered_rows = 0
+
+        def finish_zip():
+            nonlocal parts, buffered_rows
+            if parts:
+                aggregated = combine_partials(parts)
+                buffer.append(aggregated)
+                buffered_rows += len(aggregated)
+            parts = []
+            if buffered_rows >= chunk_size:
+                flush()
+
+        for zip_file, df in iter_station_frames(zip_folder, station_workers, dtype):
+            if zip_file != current_zip:
+                finish_zip()
+                current_zip = zip_file
+            parts.append(partial_aggregate(df))
+        finish_zip()
+        flush()
+        rows = out.rows
+
+    print(f"Streaming pipeline finished. {rows} rows written to {final_path}")
+    return rows
+
+
+def run_dask_pipeline(processed_folder, final_path, group_keys=DEFAULT_GROUP_KEYS, pressure_bin=None,
+                      split_out=8, dtype=np.float64):
+    """
+    Out-of-core Aggregate -> TEOS-10 with Dask over the Parquet shards in processed_folder
+    (<stem>_processed.parquet, as written for this engine; CSV shards of other runs in the
+    folder are ignored). Shards are read lazily, one partition per shard, and the result is written as
+    partitioned Parquet to the directory final_path, so the dataset never has to fit in
+    memory. With CRUISE in group_keys no group spans two shards and each partition is
+    aggregated on its own; otherwise Dask runs a shuffled group-by into split_out
+    partitions (row order is then not the one of the pandas pipeline).
+    """
+    import dask.dataframe as dd
+
+    shard_files = processed_shards(processed_folder, 'parquet')
+    if not shard_files:
+        print("No Parquet shards found or processed.")
+        return None
+
+    meta = pd.DataFrame({col: pd.Series(dtype=dtype) for col in AGGREGATED_COLUMNS})
+    shards = dd.from_map(read_table, shard_files, columns=AGGREGATED_COLUMNS, meta=meta)
+
+    if 'CRUISE' in group_keys:
+        aggregated = shards.map_partitions(lambda df: aggregate_frames([df], group_keys, pressure_bin), meta=meta)
+    else:
+        if 'PRS_BIN' in group_keys:
+            if not pressure_bin:
+                raise ValueError("Grouping by PRS_BIN needs a pressure_bin width in dbar")
+            shards = shards.map_partitions(with_pressure_bin, pressure_bin,
+                                           meta=meta.assign(PRS_BIN=pd.Series(dtype=dtype)))
+        aggregated = shards.groupby(list(group_keys)).agg(aggregation_spec(group_keys), split_out=split_out)
+        aggregated = aggregated.reset_index()[AGGREGATED_COLUMNS]
+
+    teos_meta = meta.assign(**{col: pd.Series(dtype=dtype) for col in ('depth_m', 'SA', 'CT', 'sound_speed')})
+    # Dask already runs partitions in parallel, so each one converts on a single thread
+    final = aggregated.map_partitions(apply_teos10, workers=1, dtype=dtype, meta=teos_meta)
+    final.to_parquet(final_path, write_index=False, compression='zstd')
+    print(f"Dask pipeline finished. Partitioned Parquet at: {final_path}")
+    return final_path
+
+
 def main():
     parser = argparse.ArgumentParser(description="DataCreation Pipeline: Zip -> Aggregate -> TEOS-10 Conversion")
     parser.add_argument('--zip_folder', type=str, required=True, help='Folder containing zip files')
-    parser.add_argument('--processed_folder', type=str, default='processed_data', help='Folder to store processed CSVs')
-    parser.add_argument('--aggregated_csv', type=str, default='aggregated.csv', help='Path for aggregated CSV')
+    parser.add_argument('--processed_folder', type=str, default=None, help='Folder to store processed CSVs (optional, not written if omitted)')
+    parser.add_argument('--aggregated_csv', type=str, default=None, help='Path for aggregated CSV (optional, not written if omitted)')
     parser.add_argument('--final_csv', type=str, default='Train_data.csv', help='Path for final output CSV')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for zip processing (one zip per worker)')
+    parser.add_argument('--station_workers', type=int, default=1, help='Worker processes parsing stations inside each zip')
+    parser.add_argument('--output_format', choices=SHARD_FORMATS, default='csv',
+                        help='Format of the intermediate processed/aggregated files; the final file format follows its suffix')
+    parser.add_argument('--subprocess', action='store_true',
+                        help='Run each stage as a separate script, passing data through files on disk')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream station -> aggregate -> TEOS-10 -> final file in chunks, with bounded memory')
+    parser.add_argument('--chunk_size', type=int, default=1_000_000, help='Rows per TEOS-10 chunk with --stream')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only parse zip files that are new or changed since the last run (needs --processed_folder)')
+    parser.add_argument('--group_keys', nargs='+', choices=GROUP_KEYS, default=list(DEFAULT_GROUP_KEYS),
+                        help='Columns the aggregation groups by (PRS_BIN needs --pressure_bin)')
+    parser.add_argument('--pressure_bin', type=float, default=None, help='Pressure bin width in dbar for the PRS_BIN group key')
+    parser.add_argument('--engine', choices=['pandas', 'dask'], default='pandas',
+                        help='dask: aggregate and convert out-of-core from Parquet shards; --final_csv becomes a directory of Parquet files')
+    parser.add_argument('--compact', action='store_true',
+                        help='Parse, aggregate and store float32 values instead of float64 (about half the memory and Parquet size)')
     args = parser.parse_args()
+    dtype = COMPACT_DTYPE if args.compact else np.float64
+    if args.engine == 'dask':
+        processed_folder = args.processed_folder or 'processed_data'
+        process_zip_files(args.zip_folder, processed_folder, args.workers, args.station_workers,
+                          'parquet', args.incremental, dtype)
+        run_dask_pipeline(processed_folder, args.final_csv, args.group_keys, args.pressure_bin, dtype=dtype)
+        print("\nPipeline complete! Final data at:", args.final_csv)
+        return
+    if args.stream:
+        if tuple(args.group_keys) != DEFAULT_GROUP_KEYS:
+            parser.error("--stream aggregates per zip and latitude only, it cannot be combined with --group_keys")
+        run_streaming_pipeline(args.zip_folder, args.final_csv, args.station_workers, args.chunk_size, dtype)
+        print("\nPipeline complete! Final data at:", args.final_csv)
+        return
+    if args.output_format == 'parquet' and args.aggregated_csv:
+        args.aggregated_csv = str(Path(args.aggregated_csv).with_suffix('.parquet'))
+
+    if not args.subprocess:
+        run_pipeline(args.zip_folder, args.processed_folder, args.aggregated_csv, args.final_csv,
+                     args.workers, args.station_workers, args.output_format, args.incremental,
+                     args.group_keys, args.pressure_bin, dtype)
+        print("\nPipeline complete! Final data at:", args.final_csv)
+        return
 
+    processed_folder = args.processed_folder or 'processed_data'
+    aggregated_csv = args.aggregated_csv or ('aggregated.parquet' if args.output_format == 'parquet' else 'aggregated.csv')
     # Step 1: Unzip and process
-    run_zipstrippor(args.zip_folder, args.processed_folder)
+    run_zipstrippor(args.zip_folder, processed_folder, args.workers, args.station_workers,
+                    args.output_format, args.incremental, args.compact)
     # Step 2: Aggregate
-    run_aggregator(args.processed_folder, args.aggregated_csv)
+    run_aggregator(processed_folder, aggregated_csv, args.group_keys, args.pressure_bin, args.output_format)
     # Step 3: TEOS-10 conversion
-    run_conversion_functions(args.aggregated_csv, args.final_csv)
+    run_conversion_functions(aggregated_csv, args.final_csv, args.compact)
     print("\nPipeline complete! Final data at:", args.final_csv)
 
 if __name__ == "__main__":
@@ -1,78 +1,420 @@
+import io
 import os
+import re
 import zipfile
+import numpy as np
 import pandas as pd
-import tempfile
-import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 import argparse
 
-def stripping(filepath):
+from manifest import Manifest
+from table_io import TableWriter
+
+# Bump whenever a change to the parsing or filtering changes the processed shards, so
+# incremental runs (--incremental) reprocess every zip
+PARSER_VERSION = 1
+
+# Lines holding only whitespace (optionally followed by a comment) are skipped by the
+# line-by-line reader but would come out of the C parser as all-NaN rows
+_BLANK_LINES = re.compile(rb'^[ \t]+(?=#|\r?$)', re.MULTILINE)
+
+
+def _next_line(buf, pos):
+    """Returns (stripped line, position of the following line) for buf[pos:]."""
+    eol = buf.find(b'\n', pos)
+    if eol == -1:
+        eol = len(buf)
+    return buf[pos:eol].strip(), eol + 1
+
+
+def _scan_header(buf):
     """
-    Reads a WOCE CTD csv file, filters comments and metadata, extracts latitude/longitude,
-    parses header and data, and returns a DataFrame with LATITUDE, LONGITUDE, and data columns.
+    Walks the header of a WOCE CTD file once and returns (lat, lon, header, start, stop),
+    where buf[start:stop] is the raw data block between the units row and END_DATA.
+    Returns header=None if no LATITUDE / CTDPRS header row was found.
     """
-    import pandas as pd
     lat = None
     lon = None
-    header = None
-    data_lines = []
     found_lat = False
-    found_header = False
-    
-    with open(filepath, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Skip comment lines and metadata
+    pos = 0
+    n = len(buf)
+
+    while pos < n:
+        line, pos = _next_line(buf, pos)
+
         if not found_lat:
-            if line.startswith('LATITUDE'):
-                lat = float(line.split('=')[1].strip(','))
+            if line.startswith(b'LATITUDE'):
+                lat = float(line.split(b'=')[1].strip(b','))
                 # Next line should be LONGITUDE
-                i += 1
-                lon_line = lines[i].strip()
-                if lon_line.startswith('LONGITUDE'):
-                    lon = float(lon_line.split('=')[1].strip(','))
+                lon_line, pos = _next_line(buf, pos)
+                if lon_line.startswith(b'LONGITUDE'):
+                    lon = float(lon_line.split(b'=')[1].strip(b','))
                 found_lat = True
-        elif not found_header:
-            if line.startswith('CTDPRS'):
-                header = line.split(',')
-                # Add LATITUDE and LONGITUDE to header
-                header = ['LATITUDE', 'LONGITUDE'] + header
-                found_header = True
-                i += 1  # skip the next line (usually units)
-        elif found_header:
-            # Stop at END_DATA
-            if line.startswith('END_DATA'):
-                break
-            # Only process non-empty, non-comment lines
-            if line and not line.startswith('#'):
-                values = line.split(',')
-                # Prepend lat/lon to each row
-                row = [lat, lon] + [float(v) if v else None for v in values]
-                data_lines.append(row)
-        i += 1
-    
-    # Create DataFrame
-    df = pd.DataFrame(data_lines, columns=header)
-    return df
-
-def process_zip_files(data_folder="data", output_folder="processed_data"):
-    """
-    Process all zip files in the data folder, extract and process CSV files,
-    and save concatenated results for each zip file.
-    """
-    # Columns to keep in final dataframe
-    columns_to_keep = ["LATITUDE", "LONGITUDE", "CTDPRS", "CTDTMP", "CTDSAL"]
+        elif line.startswith(b'CTDPRS'):
+            header = line.decode('utf-8').split(',')
+            # skip the next line (usually units)
+            _, start = _next_line(buf, pos)
+            start = min(start, n)
+            # Stop at the first line starting with END_DATA
+            stop = buf.find(b'END_DATA', start)
+            while stop != -1 and buf[buf.rfind(b'\n', 0, stop) + 1:stop].strip():
+                stop = buf.find(b'END_DATA', stop + 1)
+            if stop == -1:
+                stop = n
+            return lat, lon, header, start, stop
+
+    return lat, lon, None, n, n
+
+
+_parse_kernel = None
+
+
+def _compiled_parser():
+    """ctd_parse_kernel.parse_block when numba is installed, else False."""
+    global _parse_kernel
+    if _parse_kernel is None:
+        try:
+            from ctd_parse_kernel import parse_block
+            _parse_kernel = parse_block
+        except ImportError:
+            _parse_kernel = False
+    return _parse_kernel
+
+
+@lru_cache(maxsize=16)
+def _wide_row(n_cols):
+    # A data line with more than n_cols fields (n_cols commas before any comment)
+    return re.compile(rb'^(?:[^,#\n]*,){%d}' % n_cols, re.MULTILINE)
+
+
+def _read_block(block, n_cols, dtype=np.float64):
+    """
+    The data rows of block as a (rows, n_cols) array of dtype. The common block (plain
+    numbers, at most comments and blank lines) goes through the compiled parser of
+    ctd_parse_kernel.py, or np.loadtxt without numba; anything they reject (empty or
+    missing fields, text) through the pandas C parser. A row with more fields than the
+    header raises ValueError, as in the line-by-line reader.
+    """
+    parse_block = _compiled_parser()
+    if parse_block:
+        values = parse_block(block, n_cols)
+        if values is not None:
+            return values if dtype == np.float64 else values.astype(dtype)
+    else:
+        try:
+            values = np.loadtxt(io.BytesIO(block), delimiter=',', comments='#', dtype=dtype, ndmin=2)
+            if values.shape[1] == n_cols:
+                return values
+        except ValueError:
+            pass
+    wide = _wide_row(n_cols).search(block)
+    if wide:
+        end = block.find(b'\n', wide.start())
+        line = block[wide.start():end if end != -1 else len(block)]
+        raise ValueError(f"Data row with more than {n_cols} fields: {line.strip().decode(errors='replace')!r}")
+    # Lines holding only blanks (and a comment) would be all-NaN rows or fail to parse
+    if _BLANK_LINES.search(block):
+        block = _BLANK_LINES.sub(b'', block)
+    return pd.read_csv(io.BytesIO(block), header=None, names=range(n_cols), comment='#',
+                       skip_blank_lines=True, skipinitialspace=True, dtype=dtype,
+                       engine='c').to_numpy()
+
+
+@lru_cache(maxsize=64)
+def _frame_columns(header):
+    # Building the column Index from a list of names costs more than the frame itself;
+    # the few distinct headers of a cruise are built once
+    return pd.Index(('LATITUDE', 'LONGITUDE') + header)
+
+
+def parse_ctd_bytes(buf, dtype=np.float64):
+    """
+    Parses the raw bytes of a WOCE CTD csv file. The header is scanned once in Python and
+    the data block is parsed in a single call (see _read_block). Returns the same
+    DataFrame as the line-by-line reader: LATITUDE, LONGITUDE, then the file's columns,
+    as float64, or as the given dtype (e.g. COMPACT_DTYPE).
+    """
+    lat, lon, header, start, stop = _scan_header(buf)
+    if header is None:
+        return pd.DataFrame()
+
+    columns = _frame_columns(tuple(header))
+    block = buf[start:stop]
+    if not block.strip():
+        return pd.DataFrame([], columns=columns)
+
+    values = _read_block(block, len(header), dtype)
+
+    if lat is None or lon is None:
+        df = pd.DataFrame(values, columns=header)
+        df.insert(0, 'LATITUDE', lat)
+        df.insert(1, 'LONGITUDE', lon)
+        return df
+
+    # Build the frame as a single block instead of inserting columns one by one
+    out = np.empty((values.shape[0], values.shape[1] + 2), dtype=dtype)
+    out[:, 0] = lat
+    out[:, 1] = lon
+    out[:, 2:] = values
+    return pd.DataFrame(out, columns=columns, copy=False)
+
+
+def stripping(filepath, dtype=np.float64):
+    """
+    Reads a WOCE CTD csv file, filters comments and metadata, extracts latitude/longitude,
+    parses header and data, and returns a DataFrame with LATITUDE, LONGITUDE, and data columns.
+    filepath may also be an open binary stream, e.g. a member opened with ZipFile.open().
+    The values are parsed straight into dtype (float64, or COMPACT_DTYPE to halve memory).
+    """
+    if hasattr(filepath, 'read'):
+        return parse_ctd_bytes(filepath.read(), dtype)
+    with open(filepath, 'rb') as f:
+        buf = f.read()
+    return parse_ctd_bytes(buf, dtype)
+
+
+def csv_members(zip_ref):
+    """Names of all CSV members of an open ZipFile, at any depth."""
+    return [info.filename for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.endswith('.csv')]
+
+# Columns to keep in final dataframe
+COLUMNS_TO_KEEP = ["LATITUDE", "LONGITUDE", "CTDPRS", "CTDTMP", "CTDSAL"]
+
+# dtype of the compact mode (--compact): float32 holds lat/lon, pressure, temperature and
+# salinity at CTD precision (7 significant digits) in half the memory and disk of float64
+COMPACT_DTYPE = np.float32
+
+# File formats of the processed shards (--output_format)
+SHARD_FORMATS = ('csv', 'parquet')
+
+# Zip file opened once per station worker process, see _open_worker_zip
+_worker_zip = None
+
+
+def shard_version(dtype=np.float64):
+    """Version recorded in the manifest for shards parsed with dtype; a dtype change re-parses."""
+    return PARSER_VERSION if np.dtype(dtype) == np.float64 else f"{PARSER_VERSION}-{np.dtype(dtype).name}"
+
+
+def parse_station(zip_ref, csv_file, dtype=np.float64):
+    """
+    Parse one station member of an open ZipFile down to COLUMNS_TO_KEEP, as dtype.
+    Returns (DataFrame or None, log line or None).
+    """
+    csv_name = Path(csv_file).name
+    try:
+        with zip_ref.open(csv_file) as member:
+            df = stripping(member, dtype)
+        
+        # Filter to keep only required columns (if they exist)
+        if not any(col in df.columns for col in COLUMNS_TO_KEEP):
+            return None, f"    Warning: No required columns found in {csv_name}"
+        # reindex() fills missing columns with float64 NaN, keep them in dtype
+        df = df.reindex(columns=COLUMNS_TO_KEEP).astype(dtype)
+        
+        # Remove rows with all NaN values (except lat/lon)
+        df = df.dropna(subset=COLUMNS_TO_KEEP[2:], how='all')
+        return df, None
     
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+    except Exception as e:
+        return None, f"    Error processing {csv_name}: {str(e)}"
+
+
+def _open_worker_zip(zip_file):
+    global _worker_zip
+    _worker_zip = zipfile.ZipFile(zip_file, 'r')
+
+
+def _parse_station_in_worker(csv_file, dtype=np.float64):
+    return parse_station(_worker_zip, csv_file, dtype)
+
+
+def iter_stations(zip_ref, zip_file, csv_files, station_workers=1, dtype=np.float64):
+    """
+    Yield parse_station results for csv_files in archive order. With station_workers > 1
+    the members are parsed in a process pool; at most 2 * station_workers results are in
+    flight at any time, so memory does not grow with the number of stations in the zip.
+    """
+    if station_workers <= 1:
+        for csv_file in csv_files:
+            yield parse_station(zip_ref, csv_file, dtype)
+        return
     
-    # Get all zip files in the data folder
-    data_path = Path(data_folder)
-    zip_files = list(data_path.glob("*.zip"))
+    with ProcessPoolExecutor(max_workers=station_workers, initializer=_open_worker_zip,
+                             initargs=(str(zip_file),)) as pool:
+        yield from bounded_map(pool, partial(_parse_station_in_worker, dtype=dtype), csv_files,
+                               2 * station_workers)
+
+
+def bounded_map(pool, fn, items, window):
+    """
+    Like pool.map, but keeps at most `window` tasks submitted and unconsumed, so results
+    are produced no faster than the caller consumes them. Results come in input order.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def shard_path(zip_file, output_folder, output_format='csv'):
+    """Path of the processed shard written for zip_file."""
+    return Path(output_folder) / f"{Path(zip_file).stem}_processed.{output_format}"
+
+
+def processed_shards(output_folder, output_format='csv'):
+    """
+    The processed shards in output_folder written in output_format, sorted: only
+    <stem>_processed.<output_format> files, so shards left in the other format by an
+    earlier run and unrelated files in the folder are not read.
+    """
+    return sorted(Path(output_folder).glob(f"*_processed.{output_format}"))
+
+
+def process_zip(zip_file, output_folder, station_workers=1, output_format='csv', dtype=np.float64):
+    """
+    Process the station CSVs of one zip file and save them as <stem>_processed.csv, or
+    as <stem>_processed.parquet with output_format='parquet'. Values are parsed and
+    stored as dtype (COMPACT_DTYPE gives float32 Parquet columns).
+    Stations are appended to the output as they are parsed instead of being held in
+    memory until the end. Progress and errors are collected and returned as a list of
+    log lines, so that callers running several zips at once can report them in order.
+    """
+    zip_file = Path(zip_file)
+    log = [f"\nProcessing: {zip_file.name}"]
+    output_path = shard_path(zip_file, output_folder, output_format)
+    output_filename = output_path.name
+    partial_path = output_path.with_name(f"{zip_file.stem}_processed.part.{output_format}")
+    
+    try:
+        # Station files are read straight from the archive, nothing is extracted to disk
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            csv_files = csv_members(zip_ref)
+            
+            if not csv_files:
+                log.append(f"  No CSV files found in {zip_file.name}")
+                return log
+            
+            log.append(f"  Found {len(csv_files)} CSV files")
+            
+            successful_files = 0
+            with TableWriter(partial_path) as out:
+                for df, message in iter_stations(zip_ref, zip_file, csv_files, station_workers, dtype):
+                    if message:
+                        log.append(message)
+                    if df is None:
+                        continue
+                    out.write(df)
+                    successful_files += 1
+            n_rows = out.rows
+        
+        if successful_files:
+            os.replace(partial_path, output_path)
+            log.append(f"  Successfully processed {successful_files} files")
+            log.append(f"  Combined dataframe shape: {(n_rows, len(COLUMNS_TO_KEEP))}")
+            log.append(f"  Saved as: {output_filename}")
+        else:
+            log.append(f"  No valid data found in {zip_file.name}")
+            
+    except Exception as e:
+        log.append(f"  Error processing zip file {zip_file.name}: {str(e)}")
+    
+    finally:
+        if partial_path.exists():
+            partial_path.unlink()
+    
+    return log
+
+
+def zip_to_frame(zip_file, station_workers=1, dtype=np.float64):
+    """
+    In-memory counterpart of process_zip: returns (DataFrame or None, log lines) for one
+    zip file without writing anything to disk.
+    """
+    zip_file = Path(zip_file)
+    log = [f"\nProcessing: {zip_file.name}"]
+    
+    try:
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            csv_files = csv_members(zip_ref)
+            
+            if not csv_files:
+                log.append(f"  No CSV files found in {zip_file.name}")
+                return None, log
+            
+            log.append(f"  Found {len(csv_files)} CSV files")
+            
+            dataframes = []
+            for df, message in iter_stations(zip_ref, zip_file, csv_files, station_workers, dtype):
+                if message:
+                    log.append(message)
+                if df is not None:
+                    dataframes.append(df)
+        
+        if dataframes:
+            combined_df = pd.concat(dataframes, ignore_index=True)
+            log.append(f"  Successfully processed {len(dataframes)} files")
+            log.append(f"  Combined dataframe shape: {combined_df.shape}")
+            return combined_df, log
+        log.append(f"  No valid data found in {zip_file.name}")
+            
+    except Exception as e:
+        log.append(f"  Error processing zip file {zip_file.name}: {str(e)}")
+    
+    return None, log
+
+
+def _zip_to_frame_args(args):
+    return zip_to_frame(*args)
+
+
+def iter_zip_frames(data_folder, workers=1, station_workers=1, zip_files=None, dtype=np.float64):
+    """
+    Yield (zip_file, DataFrame) for every zip in data_folder (or in the given list of
+    zip_files) that has valid data, in order, printing each zip's log as it goes. With
+    workers > 1 the zips are parsed in a process pool with a bounded number of finished
+    frames waiting in memory. Values are parsed as dtype.
+    """
+    if zip_files is None:
+        zip_files = sorted(Path(data_folder).glob("*.zip"))
+        
+        if not zip_files:
+            print(f"No zip files found in {data_folder}")
+            return
+        
+        print(f"Found {len(zip_files)} zip files to process")
+    
+    tasks = [(zip_file, station_workers, dtype) for zip_file in zip_files]
+    if workers > 1 and len(zip_files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(zip_files))) as pool:
+            results = bounded_map(pool, _zip_to_frame_args, tasks, 2 * workers)
+            for zip_file, (df, log) in zip(zip_files, results):
+                print("\n".join(log))
+                if df is not None:
+                    yield zip_file, df
+    else:
+        for zip_file in zip_files:
+            df, log = zip_to_frame(zip_file, station_workers, dtype)
+            print("\n".join(log))
+            if df is not None:
+                yield zip_file, df
+
+
+def iter_station_frames(data_folder, station_workers=1, dtype=np.float64):
+    """
+    Yield (zip_file, station DataFrame) for every valid station of every zip in
+    data_folder, in sorted zip order and archive order within a zip. Only the stations
+    currently being parsed are held in memory; each zip's log is printed once it is done.
+    Values are parsed as dtype.
+    """
+    zip_files = sorted(Path(data_folder).glob("*.zip"))
     
     if not zip_files:
         print(f"No zip files found in {data_folder}")
@@ -81,75 +423,115 @@ def process_zip_files(data_folder="data", output_folder="processed_data"):
     print(f"Found {len(zip_files)} zip files to process")
     
     for zip_file in zip_files:
-        print(f"\nProcessing: {zip_file.name}")
-        
-        # Create temporary directory for extracting files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                # Extract zip file
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                
-                # Find all CSV files in extracted content
-                temp_path = Path(temp_dir)
-                csv_files = list(temp_path.rglob("*.csv"))
-                
-                if not csv_files:
-                    print(f"  No CSV files found in {zip_file.name}")
-                    continue
-                
-                print(f"  Found {len(csv_files)} CSV files")
-                
-                # Process each CSV file and collect dataframes
-                dataframes = []
+        log = [f"\nProcessing: {zip_file.name}"]
+        try:
+            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+                csv_files = csv_members(zip_ref)
+                log.append(f"  Found {len(csv_files)} CSV files")
                 successful_files = 0
-                
-                for csv_file in csv_files:
-                    try:
-                        df = stripping(str(csv_file))
-                        
-                        # Filter to keep only required columns (if they exist)
-                        available_columns = [col for col in columns_to_keep if col in df.columns]
-                        if available_columns:
-                            df_filtered = df[available_columns].copy()
-                            dataframes.append(df_filtered)
-                            successful_files += 1
-                        else:
-                            print(f"    Warning: No required columns found in {csv_file.name}")
-                            
-                    except Exception as e:
-                        print(f"    Error processing {csv_file.name}: {str(e)}")
-                
-                # Concatenate all dataframes if any were successfully processed
-                if dataframes:
-                    combined_df = pd.concat(dataframes, ignore_index=True)
-                    
-                    # Remove rows with all NaN values (except lat/lon)
-                    combined_df = combined_df.dropna(subset=[col for col in combined_df.columns 
-                                                           if col not in ['LATITUDE', 'LONGITUDE']], 
-                                                    how='all')
-                    
-                    # Save to CSV with zip file name
-                    output_filename = f"{zip_file.stem}_processed.csv"
-                    output_path = Path(output_folder) / output_filename
-                    combined_df.to_csv(output_path, index=False)
-                    
-                    print(f"  Successfully processed {successful_files} files")
-                    print(f"  Combined dataframe shape: {combined_df.shape}")
-                    print(f"  Saved as: {output_filename}")
-                else:
-                    print(f"  No valid data found in {zip_file.name}")
-                    
-            except Exception as e:
-                print(f"  Error processing zip file {zip_file.name}: {str(e)}")
+                for df, message in iter_stations(zip_ref, zip_file, csv_files, station_workers, dtype):
+                    if message:
+                        log.append(message)
+                    if df is not None:
+                        successful_files += 1
+                        yield zip_file, df
+                log.append(f"  Successfully processed {successful_files} files")
+        except Exception as e:
+            log.append(f"  Error processing zip file {zip_file.name}: {str(e)}")
+        print("\n".join(log))
+
+
+def stale_zip_files(zip_files, output_folder, output_format, manifest):
+    """
+    Select the zips whose shard is missing or out of date according to manifest.
+    Their old shards (in every format, so a shard of a previous --output_format is not
+    left next to the new one) and manifest entries are removed, so only a successful run
+    can record them again. Zips recorded in the manifest but no longer in zip_files lose
+    their shards and entries too, so the aggregation does not read them any more.
+    Returns {zip_file: fingerprint taken now} in zip order.
+    """
+    stale = [z for z in zip_files if not manifest.is_up_to_date(z, shard_path(z, output_folder, output_format))]
+    current = {manifest.key(z) for z in zip_files}
+    removed = [key for key in manifest.entries if key not in current]
+    print(f"{len(zip_files) - len(stale)} zip files up to date, {len(stale)} to process, "
+          f"{len(removed)} removed")
+    fingerprints = {}
+    for zip_file in stale:
+        fingerprints[zip_file] = manifest.fingerprint(zip_file)
+    for zip_file in stale + removed:
+        manifest.forget(zip_file)
+        for shard_format in SHARD_FORMATS:
+            shard_path(zip_file, output_folder, shard_format).unlink(missing_ok=True)
+    return fingerprints
+
+
+def process_zip_files(data_folder="data", output_folder="processed_data", workers=1, station_workers=1,
+                      output_format='csv', incremental=False, dtype=np.float64):
+    """
+    Process all zip files in the data folder, stream and process the CSV files inside
+    each archive, and save concatenated results for each zip file.
+    With workers > 1 the zips are processed in a pool of worker processes, one zip per
+    worker; the output files are the same as in a serial run and the per-zip logs are
+    printed in zip order. station_workers > 1 additionally parses the stations inside
+    each zip in parallel, which helps for cruises with thousands of station files.
+    output_format='parquet' writes typed, zstd-compressed Parquet shards instead of CSV.
+    dtype=COMPACT_DTYPE parses and stores float32 values instead of float64.
+    With incremental=True, zips recorded in the output folder's manifest as unchanged
+    since their shard was written are skipped.
+    """
+    # Create output folder if it doesn't exist
+    os.makedirs(output_folder, exist_ok=True)
+    
+    # Get all zip files in the data folder
+    data_path = Path(data_folder)
+    zip_files = sorted(data_path.glob("*.zip"))
+    
+    if not zip_files:
+        print(f"No zip files found in {data_folder}")
+        # The manifest still has to drop the shards of zips that were removed
+        if not incremental:
+            return
+    else:
+        print(f"Found {len(zip_files)} zip files to process")
+    
+    if incremental:
+        manifest = Manifest(output_folder, shard_version(dtype))
+        fingerprints = stale_zip_files(zip_files, output_folder, output_format, manifest)
+        zip_files = list(fingerprints)
+    
+    if workers > 1 and len(zip_files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(zip_files))) as pool:
+            # map() yields results in submission order, so logs stay grouped per zip
+            for log in pool.map(process_zip, zip_files, [output_folder] * len(zip_files),
+                                [station_workers] * len(zip_files), [output_format] * len(zip_files),
+                                [dtype] * len(zip_files)):
+                print("\n".join(log))
+    else:
+        for zip_file in zip_files:
+            print("\n".join(process_zip(zip_file, output_folder, station_workers, output_format, dtype)))
+    
+    if incremental:
+        for zip_file in zip_files:
+            output_path = shard_path(zip_file, output_folder, output_format)
+            if output_path.exists():
+                manifest.record(zip_file, output_path, fingerprints[zip_file])
+        manifest.save()
 
 def main():
     parser = argparse.ArgumentParser(description="Process zip files to extract and process CSVs.")
     parser.add_argument('--data_folder', type=str, default="D:/DS & ML/MLE/dataset/ewoce/data", help='Folder containing zip files')
     parser.add_argument('--output_folder', type=str, default="processed_data", help='Folder to store processed CSVs')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes, one zip file per worker')
+    parser.add_argument('--station_workers', type=int, default=1, help='Number of worker processes parsing the stations inside each zip file')
+    parser.add_argument('--output_format', choices=SHARD_FORMATS, default='csv', help='File format of the processed output per zip')
+    parser.add_argument('--incremental', action='store_true', help='Skip zip files whose processed output is already up to date')
+    parser.add_argument('--compact', action='store_true', help='Parse and store float32 values instead of float64 (half the size)')
     args = parser.parse_args()
-    process_zip_files(data_folder=args.data_folder, output_folder=args.output_folder)
+    process_zip_files(data_folder=args.data_folder, output_folder=args.output_folder,
+                      workers=args.workers, station_workers=args.station_workers,
+                      output_format=args.output_format, incremental=args.incremental,
+                      dtype=COMPACT_DTYPE if args.compact else np.float64)
     print("\nProcessing complete!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
 import gsw
 
+# Sentinel values used for missing data in the CTD files
+INVALID_VALUES = (-999, -9999, 9999, 99999)
+
+# Optional physical range checks for apply_teos10(ranges=PHYSICAL_RANGES), keyed by column
+PHYSICAL_RANGES = {
+    "CTDPRS": (0.0, 12000.0),     # dbar
+    "CTDTMP": (-2.5, 40.0),       # degC
+    "CTDSAL": (0.0, 42.0),        # PSU
+    "LATITUDE": (-90.0, 90.0),
+    "LONGITUDE": (-180.0, 360.0),
+}
+
+# Rows per block in teos10_columns(): large enough to amortise the per-call overhead of
+# the gsw ufuncs, small enough that a block's temporaries stay in cache
+TEOS10_CHUNK_SIZE = 1 << 16
+
+# Practical -> Absolute Salinity scale factor used by gsw.SA_from_SP (35.16504 / 35)
+SSO_RATIO = 35.16504 / 35.0
+
+# Box around the Baltic Sea, where gsw.SA_from_SP ignores the SAAR atlas and uses its own
+# Baltic formula instead (see sa_from_saar)
+BALTIC_BOX = ((5.0, 46.0), (49.0, 70.0))    # (lon range on 0-360, lat range)
+
+# memoized_saar() keeps a dense (site x pressure level) table while it has at most this
+# many entries per input row
+SAAR_TABLE_FACTOR = 4
+
+
 def compute_depth(pressure_dbar, latitude):
     """
     Convert pressure (dbar) to depth (m) using TEOS-10.
@@ -16,7 +47,156 @@ def compute_depth(pressure_dbar, latitude):
     return depth_m
 
 
-def compute_sound_speed(pressure_dbar, temperature_in_situ, salinity_sp, lon, lat):
+def station_starts(lon, lat):
+    """
+    First row of every station (cast) in 1-D arrays of lon and lat in table order:
+    consecutive rows with the same position are one station, as written by the pipeline.
+    """
+    n = len(lon)
+    if n == 0:
+        return np.empty(0, dtype=np.intp)
+    # Station boundaries: rows where lon or lat differs from the previous row
+    new_station = np.empty(n, dtype=bool)
+    new_station[0] = True
+    np.not_equal(lon[1:], lon[:-1], out=new_station[1:])
+    new_station[1:] |= lat[1:] != lat[:-1]
+    return np.flatnonzero(new_station)
+
+
+def memoized_saar(p, lon, lat):
+    """
+    Absolute Salinity Anomaly Ratio (gsw.SAAR) for 1-D arrays of pressure, lon and lat,
+    interpolated from the atlas once per unique (lon, lat, pressure) and broadcast back
+    to the rows. Consecutive rows with the same (lon, lat) are one station, so stations
+    are found from the row order; repeat occupations of a site on the same pressure grid
+    (and duplicated rows) are then looked up only once.
+    Falls back to one lookup per row when sites x pressure levels would not fit in a
+    table of SAAR_TABLE_FACTOR entries per row, i.e. when there is little to share.
+    Returns the same values as gsw.SAAR(p, lon, lat).
+    """
+    n = len(p)
+    if n == 0:
+        return np.empty(0, dtype=np.float64)
+    starts = station_starts(lon, lat)
+    # One code per site (stations re-occupied at the same position share it)
+    site_of_station, sites = pd.factorize(lon[starts] + 1j * lat[starts], use_na_sentinel=False)
+    level, levels = pd.factorize(p, use_na_sentinel=False)
+    table_size = len(sites) * len(levels)
+    if table_size > SAAR_TABLE_FACTOR * n:
+        return gsw.SAAR(p, lon, lat)
+
+    site = np.repeat(site_of_station, np.diff(starts, append=n))
+    key = site * len(levels) + level
+    used = np.zeros(table_size, dtype=bool)
+    used[key] = True
+    entries = np.flatnonzero(used)
+    table = np.empty(table_size, dtype=np.float64)
+    positions = sites[entries // len(levels)]
+    table[entries] = gsw.SAAR(levels[entries % len(levels)], positions.real, positions.imag)
+    return table[key]
+
+
+def sa_from_saar(SP, p, lon, lat, saar):
+    """
+    Absolute Salinity from Practical Salinity and a precomputed SAAR (see memoized_saar),
+    bit-identical to gsw.SA_from_SP(SP, p, lon, lat). Rows inside BALTIC_BOX go through
+    gsw.SA_from_SP, which uses a separate formula for the Baltic Sea.
+    """
+    SA = SSO_RATIO * SP * (1.0 + saar)
+    (lon_min, lon_max), (lat_min, lat_max) = BALTIC_BOX
+    lon360 = np.mod(lon, 360.0)
+    baltic = (lon360 >= lon_min) & (lon360 <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+    if baltic.any():
+        SA[baltic] = gsw.SA_from_SP(SP[baltic], p[baltic], lon[baltic], lat[baltic])
+    return SA
+
+
+def _poly(x, coeffs):
+    """Horner evaluation of coeffs[0] + coeffs[1]*x + coeffs[2]*x**2 + ..."""
+    result = coeffs[-1]
+    for coeff in coeffs[-2::-1]:
+        result = result * x + coeff
+    return result
+
+
+def sound_speed_mackenzie(pressure_dbar, temperature_in_situ, salinity_sp, lat):
+    """
+    Mackenzie (1981) nine-term equation for sound speed (m/s).
+    Inputs: pressure (dbar, converted to depth with compute_depth), in-situ temperature
+    (°C), Practical Salinity and latitude. Stated range 2-30 °C, 25-40 PSU, 0-8000 m;
+    standard error 0.07 m/s against Del Grosso.
+    """
+    T = np.asarray(temperature_in_situ, dtype=np.float64)
+    S = np.asarray(salinity_sp, dtype=np.float64) - 35.0
+    D = compute_depth(pressure_dbar, lat)
+    return (1448.96 + T * (4.591 + T * (-5.304e-2 + T * 2.374e-4))
+            + 1.340 * S + D * (1.630e-2 + D * 1.675e-7)
+            - 1.025e-2 * T * S - 7.139e-13 * T * D ** 3)
+
+
+def sound_speed_del_grosso(pressure_dbar, temperature_in_situ, salinity_sp):
+    """
+    Del Grosso (1974) NRL II equation for sound speed (m/s), with pressure in kg/cm²
+    and temperature converted from ITS-90 to IPTS-68. Inputs: pressure (dbar), in-situ
+    temperature (°C), Practical Salinity. Stated range 0-30 °C, 30-40 PSU,
+    0-1000 kg/cm² (about 0-9800 dbar).
+    """
+    T = 1.00024 * np.asarray(temperature_in_situ, dtype=np.float64)
+    S = np.asarray(salinity_sp, dtype=np.float64)
+    P = 0.1019716 * np.asarray(pressure_dbar, dtype=np.float64)
+    c_t = T * (0.5012285e1 + T * (-0.551184e-1 + T * 0.221649e-3))
+    c_s = S * (0.1329530e1 + S * 0.1288598e-3)
+    c_p = P * (0.1560592 + P * (0.2449993e-4 + P * -0.8833959e-8))
+    c_stp = (T * P * (0.6353509e-2 + T * T * -0.4383615e-6
+                      + P * (-0.1593895e-5 + T * 0.2656174e-7 + P * 0.5222483e-9))
+             + S * T * (-0.1275936e-1 + T * 0.9688441e-4 + P * (-0.3406824e-3 + S * 0.4857614e-5))
+             + S * S * P * P * -0.1616745e-8)
+    return 1402.392 + c_t + c_s + c_p + c_stp
+
+
+# Chen and Millero (1977) coefficients in the UNESCO (1983) form (Fofonoff and Millard),
+# one row per power of pressure (bar), each row a polynomial in temperature (IPTS-68)
+_CHEN_MILLERO_CW = (
+    (1402.388, 5.03711, -5.80852e-2, 3.3420e-4, -1.47800e-6, 3.1464e-9),
+    (0.153563, 6.8982e-4, -8.1788e-6, 1.3621e-7, -6.1185e-10),
+    (3.1260e-5, -1.7107e-6, 2.5974e-8, -2.5335e-10, 1.0405e-12),
+    (-9.7729e-9, 3.8504e-10, -2.3643e-12),
+)
+_CHEN_MILLERO_A = (
+    (1.389, -1.262e-2, 7.164e-5, 2.006e-6, -3.21e-8),
+    (9.4742e-5, -1.2580e-5, -6.4885e-8, 1.0507e-8, -2.0122e-10),
+    (-3.9064e-7, 9.1041e-9, -1.6002e-10, 7.988e-12),
+    (1.100e-10, 6.649e-12, -3.389e-13),
+)
+_CHEN_MILLERO_B = ((-1.922e-2, -4.42e-5), (7.3637e-5, 1.7945e-7))
+_CHEN_MILLERO_D = (1.727e-3, -7.9836e-6)
+
+
+def sound_speed_chen_millero(pressure_dbar, temperature_in_situ, salinity_sp):
+    """
+    Chen and Millero (1977) equation for sound speed (m/s), the UNESCO (1983) standard,
+    with temperature converted from ITS-90 to IPTS-68. Inputs: pressure (dbar), in-situ
+    temperature (°C), Practical Salinity. Stated range 0-40 °C, 0-40 PSU, 0-10000 dbar.
+    """
+    T = 1.00024 * np.asarray(temperature_in_situ, dtype=np.float64)
+    S = np.asarray(salinity_sp, dtype=np.float64)
+    P = np.asarray(pressure_dbar, dtype=np.float64) / 10.0
+    Cw = _poly(P, [_poly(T, row) for row in _CHEN_MILLERO_CW])
+    A = _poly(P, [_poly(T, row) for row in _CHEN_MILLERO_A])
+    B = _poly(P, [_poly(T, row) for row in _CHEN_MILLERO_B])
+    D = _poly(P, _CHEN_MILLERO_D)
+    return Cw + S * (A + np.sqrt(S) * B + S * D)
+
+
+# Sound-speed methods accepted by compute_sound_speed(method=...). Against "teos10" on
+# 0-6000 dbar profiles (benchmarks/bench_sound_speed.py) the polynomials run 4-8x faster,
+# with max |error| of about 0.8 m/s (mackenzie), 0.2 m/s (del_grosso) and 0.7 m/s
+# (chen_millero, which reads ~0.5 m/s high at depth)
+SOUND_SPEED_METHODS = ("teos10", "mackenzie", "del_grosso", "chen_millero")
+
+
+def compute_sound_speed(pressure_dbar, temperature_in_situ, salinity_sp, lon, lat, memoize_saar=False,
+                        method="teos10"):
     """
     Compute sound speed (m/s) from CTD measurements using TEOS-10.
     Inputs:
@@ -24,9 +204,24 @@ def compute_sound_speed(pressure_dbar, temperature_in_situ, salinity_sp, lon, la
         temperature_in_situ: array-like, in-situ temperature in °C
         salinity_sp       : array-like, Practical Salinity (PSU)
         lon, lat          : array-like or scalar, longitude and latitude
+        memoize_saar      : look the salinity anomaly up once per unique
+                            (lon, lat, pressure), see memoized_saar()
+        method            : "teos10" (gsw, the reference), or one of the faster
+                            polynomial approximations "mackenzie", "del_grosso" and
+                            "chen_millero" (see SOUND_SPEED_METHODS and
+                            benchmarks/bench_sound_speed.py for their errors)
     Returns:
         sound_speed : array, sound speed in m/s
     """
+    if method == "mackenzie":
+        return sound_speed_mackenzie(pressure_dbar, temperature_in_situ, salinity_sp, lat)
+    if method == "del_grosso":
+        return sound_speed_del_grosso(pressure_dbar, temperature_in_situ, salinity_sp)
+    if method == "chen_millero":
+        return sound_speed_chen_millero(pressure_dbar, temperature_in_situ, salinity_sp)
+    if method != "teos10":
+        raise ValueError(f"Unknown sound speed method {method!r}, expected one of {SOUND_SPEED_METHODS}")
+
     p = np.asarray(pressure_dbar)
     t = np.asarray(temperature_in_situ)
     SP = np.asarray(salinity_sp)
@@ -34,7 +229,13 @@ def compute_sound_speed(pressure_dbar, temperature_in_situ, salinity_sp, lon, la
     lat = np.asarray(lat)
 
     # 1. Convert SP -> Absolute Salinity (SA)
-    SA = gsw.SA_from_SP(SP, p, lon, lat)
+    if memoize_saar:
+        shape = np.broadcast(SP, p, lon, lat).shape
+        SP_r, p_r, lon_r, lat_r = (np.ravel(np.broadcast_to(a, shape)).astype(np.float64)
+                                   for a in (SP, p, lon, lat))
+        SA = sa_from_saar(SP_r, p_r, lon_r, lat_r, memoized_saar(p_r, lon_r, lat_r)).reshape(shape)
+    else:
+        SA = gsw.SA_from_SP(SP, p, lon, lat)
 
     # 2. Convert in-situ T -> Conservative Temperature (CT)
     CT = gsw.CT_from_t(SA, t, p)
@@ -44,12 +245,87 @@ def compute_sound_speed(pressure_dbar, temperature_in_situ, salinity_sp, lon, la
 
     return c
 
+def valid_mask(values, ranges=None):
+    """
+    Boolean mask of the rows where none of the arrays in values is NaN or one of the
+    INVALID_VALUES sentinels, and (if ranges is given, one (low, high) or None per array)
+    every value lies in its inclusive range.
+    """
+    keep = np.ones(len(values[0]), dtype=bool)
+    for i, v in enumerate(values):
+        keep &= ~np.isnan(v)
+        keep &= ~np.isin(v, INVALID_VALUES)
+        bounds = ranges[i] if ranges is not None else None
+        if bounds is not None:
+            keep &= (v >= bounds[0]) & (v <= bounds[1])
+    return keep
+
+
+def teos10_columns(p, t, SP, lon, lat, chunk_size=TEOS10_CHUNK_SIZE, workers=None, memoize_saar=False,
+                   kernel="gsw"):
+    """
+    Depth, Absolute Salinity, Conservative Temperature and sound speed for 1-D float64
+    arrays of pressure (dbar), in-situ temperature, Practical Salinity, lon and lat.
+    The arrays are processed in blocks of chunk_size rows on a thread pool of `workers`
+    threads (default: one per CPU; the gsw ufuncs release the GIL). Results are written
+    into preallocated output arrays, so temporaries never exceed a few blocks.
+    With memoize_saar, the salinity anomaly is looked up once per unique (lon, lat,
+    pressure) over all rows before the blocks run (see memoized_saar).
+    kernel="numba" runs the fused compiled loop of teos10_kernel.py instead (needs numba
+    and a gsw build exporting its C functions, i.e. not on Windows; chunk_size and
+    memoize_saar do not apply), with identical results.
+    Returns (depth_m, SA, CT, sound_speed).
+    """
+    if kernel == "numba":
+        from teos10_kernel import teos10_fused
+        return teos10_fused(p, t, SP, lon, lat, workers=workers)
+    if kernel != "gsw":
+        raise ValueError(f"Unknown TEOS-10 kernel {kernel!r}, expected 'gsw' or 'numba'")
+    n = len(p)
+    depth_m, SA, CT, c = (np.empty(n, dtype=np.float64) for _ in range(4))
+    saar = memoized_saar(p, lon, lat) if memoize_saar else None
+
+    def run_block(start):
+        rows = slice(start, min(start + chunk_size, n))
+        p_b = p[rows]
+        # Depth from pressure (z is negative)
+        np.negative(gsw.z_from_p(p_b, lat[rows]), out=depth_m[rows])
+        # Absolute Salinity
+        if saar is None:
+            SA_b = gsw.SA_from_SP(SP[rows], p_b, lon[rows], lat[rows])
+        else:
+            SA_b = sa_from_saar(SP[rows], p_b, lon[rows], lat[rows], saar[rows])
+        SA[rows] = SA_b
+        # Conservative Temperature
+        CT[rows] = CT_b = gsw.CT_from_t(SA_b, t[rows], p_b)
+        # Sound speed
+        c[rows] = gsw.sound_speed(SA_b, CT_b, p_b)
+
+    starts = range(0, n, chunk_size)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(starts) <= 1:
+        for start in starts:
+            run_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+            # list() re-raises the first exception of any block
+            list(pool.map(run_block, starts))
+
+    return depth_m, SA, CT, c
+
+
 def apply_teos10(df,
                  pressure_col="CTDPRS",
                  temp_col="CTDTMP",
                  sal_col="CTDSAL",
                  lat_col="LATITUDE",
-                 lon_col="LONGITUDE"):
+                 lon_col="LONGITUDE",
+                 ranges=None,
+                 chunk_size=TEOS10_CHUNK_SIZE,
+                 workers=None,
+                 memoize_saar=False,
+                 kernel="gsw",
+                 dtype=np.float64):
     """
     Apply TEOS-10 conversions to a DataFrame of CTD values.
     
@@ -64,6 +340,20 @@ def apply_teos10(df,
         - longitude (deg)
     pressure_col, temp_col, sal_col, lat_col, lon_col : str
         Column names for each variable.
+    ranges : dict, optional
+        {column: (low, high)} physical range checks, e.g. PHYSICAL_RANGES. Rows with
+        NaNs or sentinel values (INVALID_VALUES) are always dropped.
+    chunk_size, workers : int, optional
+        Block size and number of threads for the gsw calls, see teos10_columns().
+    memoize_saar : bool, optional
+        Look the salinity anomaly up once per unique (lon, lat, pressure) instead of
+        once per row; pays off when stations are re-occupied on the same pressure grid.
+    kernel : {"gsw", "numba"}, optional
+        "numba" computes all four columns in one fused compiled loop (teos10_kernel.py);
+        not available on Windows.
+    dtype : numpy dtype, optional
+        dtype of the new columns, e.g. float32 for the compact pipeline. The input
+        columns keep their dtype; the TEOS-10 maths always runs in float64.
     
     Returns
     -------
@@ -74,53 +364,43 @@ def apply_teos10(df,
         - CT (Conservative Temperature)
         - sound_speed (m/s)
     """
-    # Remove rows with missing or obviously invalid values
-    invalids = [-999, -9999, 9999, 99999]
-    for col in ["CTDPRS", "CTDTMP", "CTDSAL", "LATITUDE", "LONGITUDE"]:
-        df = df[~df[col].isin(invalids)]
-    df = df.dropna(subset=["CTDPRS", "CTDTMP", "CTDSAL", "LATITUDE", "LONGITUDE"])
-    
-    p = df[pressure_col].to_numpy()
-    t = df[temp_col].to_numpy()
-    SP = df[sal_col].to_numpy()
-    lat = df[lat_col].to_numpy()
-    lon = df[lon_col].to_numpy()
-
-    # Depth from pressure (z is negative)
-    z = gsw.z_from_p(p, lat)
-    depth_m = -z
-
-    # Absolute Salinity
-    SA = gsw.SA_from_SP(SP, p, lon, lat)
+    cols = [pressure_col, temp_col, sal_col, lat_col, lon_col]
+    values = [df[col].to_numpy() for col in cols]
 
-    # Conservative Temperature
-    CT = gsw.CT_from_t(SA, t, p)
-
-    # Sound speed
-    c = gsw.sound_speed(SA, CT, p)
+    # Remove rows with missing or obviously invalid values: one boolean mask over all
+    # columns, applied once, instead of filtering (and copying) the frame per column
+    keep = valid_mask(values, ranges=[None if ranges is None else ranges.get(col) for col in cols])
+    kept = {col: v[keep] for col, v in zip(cols, values)}
+    p, t, SP, lat, lon = (np.asarray(kept[col], dtype=np.float64) for col in cols)
 
-    # Add to DataFrame
-    df = df.copy()
-    df["depth_m"] = depth_m
-    df["SA"] = SA
-    df["CT"] = CT
-    df["sound_speed"] = c
+    depth_m, SA, CT, c = teos10_columns(p, t, SP, lon, lat, chunk_size=chunk_size, workers=workers,
+                                       memoize_saar=memoize_saar, kernel=kernel)
 
-    return df
+    # Build the output from the filtered arrays, so the input is copied only once
+    rows = np.flatnonzero(keep)
+    columns = {col: kept[col] if col in kept else df[col].take(rows).to_numpy() for col in df.columns}
+    columns.update((name, values.astype(dtype, copy=False)) for name, values in
+                   (('depth_m', depth_m), ('SA', SA), ('CT', CT), ('sound_speed', c)))
+    return pd.DataFrame(columns, index=df.index[keep], copy=False)
 
 if __name__ == "__main__":
     import pandas as pd
     import sys
     import argparse
-    parser = argparse.ArgumentParser(description="Apply TEOS-10 features to a CSV file.")
-    parser.add_argument('input_csv', type=str, help='Input CSV file')
-    parser.add_argument('output_csv', type=str, nargs='?', default=None, help='Output CSV file (optional)')
+    parser = argparse.ArgumentParser(description="Apply TEOS-10 features to a CSV or Parquet file.")
+    parser.add_argument('input_csv', type=str, help='Input CSV or Parquet file')
+    parser.add_argument('output_csv', type=str, nargs='?', default=None, help='Output CSV or Parquet file (optional)')
+    parser.add_argument('--compact', action='store_true', help='Store the new columns as float32 instead of float64')
     args = parser.parse_args()
     csv_path = args.input_csv
-    out_path = args.output_csv if args.output_csv else csv_path.replace('.csv', '_teos10.csv')
-    df = pd.read_csv(csv_path)
-    df_teos = apply_teos10(df)
-    df_teos.to_csv(out_path, index=False)
+    # CSV or Parquet, picked from the file suffixes
+    from pathlib import Path
+    from table_io import read_table, write_table
+    in_path = Path(csv_path)
+    out_path = args.output_csv if args.output_csv else str(in_path.with_name(in_path.stem + '_teos10' + in_path.suffix))
+    df = read_table(csv_path)
+    df_teos = apply_teos10(df, dtype=np.float32 if args.compact else np.float64)
+    write_table(df_teos, out_path)
     print(f"TEOS-10 features added and saved to {out_path}")
 
 
@@ -0,0 +1,128 @@
+"""
+Compiled parser for the data block of a WOCE CTD file: one pass over the raw bytes
+writing the values straight into a preallocated float64 matrix. Requires numba
+(optional dependency, `pip install numba`); ZipStrippor falls back to numpy / the
+pandas C parser without it.
+
+It reads the plain decimal numbers of CTD files (sign, digits, point, exponent) with
+the exact-rounding fast path (digits forming an integer below 2**53 and a power of ten
+up to 1e22, where one multiplication or division by the power is correctly rounded),
+so its values are the ones float() gives. Anything else (text, longer numbers, a row with more
+fields than the header) makes it return None and the caller parses the block the
+general way.
+"""
+import numba
+import numpy as np
+
+# Exact powers of ten of float64
+_POWERS_OF_TEN = np.array([10.0 ** k for k in range(23)])
+# Mantissas below 2**53 are exact in float64
+_MAX_MANTISSA = 2 ** 53
+
+_NEWLINE, _CR, _SPACE, _TAB, _COMMA, _HASH = 10, 13, 32, 9, 44, 35
+_PLUS, _MINUS, _POINT = 43, 45, 46
+
+
+@numba.njit(cache=True)
+def _digits(buf, i, mantissa):
+    # Decimal digits from buf[i]: (position after them, mantissa with them appended)
+    while True:
+        d = np.int64(buf[i]) - 48
+        if d < 0 or d > 9:
+            return i, mantissa
+        mantissa = mantissa * 10 + d
+        i += 1
+
+
+@numba.njit(cache=True)
+def _parse_rows(buf, n_cols, out, powers):
+    # Rows of buf (ending with a newline, which bounds every inner loop) parsed into
+    # out; returns the number of rows, or -1 if the block needs the general parser
+    n = len(buf)
+    row = 0
+    i = 0
+    while i < n:
+        col = 0
+        content = False
+        while True:
+            # One field: blanks, [sign] digits [. digits] [e [sign] digits], blanks
+            while buf[i] == _SPACE or buf[i] == _TAB:
+                i += 1
+            c = buf[i]
+            value = np.nan
+            if not (c == _COMMA or c == _NEWLINE or c == _CR or c == _HASH):
+                negative = c == _MINUS
+                if c == _MINUS or c == _PLUS:
+                    i += 1
+                start = i
+                i, mantissa = _digits(buf, i, 0)
+                digits = i - start
+                scale = 0
+                if buf[i] == _POINT:
+                    start = i + 1
+                    i, mantissa = _digits(buf, start, mantissa)
+                    scale = start - i
+                    digits -= scale
+                if digits == 0 or digits > 18:
+                    return -1
+                if buf[i] == 101 or buf[i] == 69:     # e, E
+                    i += 1
+                    exp_negative = buf[i] == _MINUS
+                    if buf[i] == _MINUS or buf[i] == _PLUS:
+                        i += 1
+                    start = i
+                    i, exponent = _digits(buf, i, 0)
+                    if i == start or i - start > 3:
+                        return -1
+                    scale += -exponent if exp_negative else exponent
+                if mantissa >= _MAX_MANTISSA or scale < -22 or scale > 22:
+                    return -1
+                value = mantissa / powers[-scale] if scale < 0 else mantissa * powers[scale]
+                if negative:
+                    value = -value
+                while buf[i] == _SPACE or buf[i] == _TAB:
+                    i += 1
+                c = buf[i]
+                content = True
+            if c == _CR:
+                i += 1
+                c = buf[i]
+            if c == _COMMA:
+                if col == n_cols:
+                    return -1
+                out[row, col] = value
+                col += 1
+                content = True
+                i += 1
+            elif c == _NEWLINE or c == _HASH:
+                # Blank and comment-only lines give no row; short rows are padded with NaN
+                if content:
+                    if col == n_cols:
+                        return -1
+                    out[row, col] = value
+                    for k in range(col + 1, n_cols):
+                        out[row, k] = np.nan
+                    row += 1
+                # Comments run to the end of the line
+                while buf[i] != _NEWLINE:
+                    i += 1
+                i += 1
+                break
+            else:
+                return -1
+    return row
+
+
+def parse_block(block, n_cols):
+    """
+    The data rows of block (bytes) as a float64 (rows, n_cols) array, skipping blank
+    and comment lines and giving NaN for empty fields and missing trailing fields, as
+    the pandas C parser does; None if the block holds anything it does not parse.
+    """
+    if not block.endswith(b'\n'):
+        block += b'\n'
+    out = np.empty((block.count(b'\n'), n_cols))
+    rows = _parse_rows(np.frombuffer(block, dtype=np.uint8), n_cols, out, _POWERS_OF_TEN)
+    if rows < 0:
+        return None
+    return out[:rows]
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, prefix=''):
+    """
+    Size, mtime and SHA-256 of a file as {prefix + 'size', prefix + 'mtime_ns',
+    prefix + 'sha256'}, the keys fingerprint_matches() reads back.
+    """
+    st = os.stat(path)
+    return {f'{prefix}size': st.st_size, f'{prefix}mtime_ns': st.st_mtime_ns, f'{prefix}sha256': file_sha256(path)}
+
+
+def fingerprint_matches(path, fingerprint, prefix='', missing_ok=False):
+    """
+    True if the file at path still has the content described by fingerprint (as written
+    by file_fingerprint with the same prefix): same size and either the same mtime or,
+    after a touch / copy, the same SHA-256. A missing file gives missing_ok, e.g. True
+    when only a cache built from it was shipped.
+    """
+    if not Path(path).exists():
+        return missing_ok
+    st = os.stat(path)
+    if fingerprint[f'{prefix}size'] != st.st_size:
+        return False
+    return fingerprint[f'{prefix}mtime_ns'] == st.st_mtime_ns or fingerprint[f'{prefix}sha256'] == file_sha256(path)
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """
+    Open a file for writing under a temporary name (<path>.part) and rename it to path
+    when the block ends without error, so a half-written file is never picked up.
+    """
+    path = Path(path)
+    partial_path = path.with_name(path.name + '.part')
+    try:
+        with open(partial_path, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            yield f
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+    os.replace(partial_path, path)
+
+
+def save_npy(path, array):
+    """np.save of array to path through atomic_open."""
+    with atomic_open(path, 'wb') as f:
+        np.save(f, array)
+
+
+def write_json(path, obj, **kwargs):
+    """json.dump of obj to path through atomic_open (kwargs as for json.dump, indent=1 by default)."""
+    kwargs.setdefault('indent', 1)
+    with atomic_open(path) as f:
+        json.dump(obj, f, **kwargs)
+
+
+class Manifest:
+    """
+    Records which zip files have already been turned into processed shards, keyed by the
+    zip's absolute path. An entry holds the zip's size, mtime and SHA-256 together with
+    the parser version and the shard it produced. A zip is up to date when the parser
+    version and shard are unchanged and either size and mtime match, or (after a touch /
+    copy) the content hash still matches.
+    """
+
+    def __init__(self, folder, parser_version):
+        self.path = Path(folder) / MANIFEST_NAME
+        self.parser_version = parser_version
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(zip_file):
+        return str(Path(zip_file).resolve())
+
+    def is_up_to_date(self, zip_file, output_path):
+        entry = self.entries.get(self.key(zip_file))
+        if (entry is None or entry['parser_version'] != self.parser_version
+                or entry['output'] != Path(output_path).name or not Path(output_path).exists()):
+            return False
+        if not fingerprint_matches(zip_file, entry):
+            return False
+        # Same content with a new mtime: remember it so the next check is a stat only
+        entry['mtime_ns'] = os.stat(zip_file).st_mtime_ns
+        return True
+
+    @staticmethod
+    def fingerprint(zip_file):
+        """Size, mtime and hash of a zip; take it before processing the zip, so that a zip
+        modified while it is being processed is picked up again on the next run."""
+        return file_fingerprint(zip_file)
+
+    def record(self, zip_file, output_path, fingerprint):
+        """Mark zip_file, as described by fingerprint, as processed into output_path."""
+        self.entries[self.key(zip_file)] = dict(fingerprint, parser_version=self.parser_version,
+                                                output=Path(output_path).name)
+
+    def forget(self, zip_file):
+        self.entries.pop(self.key(zip_file), None)
+
+    def save(self):
+        write_json(self.path, self.entries, sort_keys=True)
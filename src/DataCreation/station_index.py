@@ -0,0 +1,189 @@
+"""
+Spatial index of the CTD casts in a final table (Train_data.csv or .parquet).
+
+A cast is a run of consecutive rows at one (LATITUDE, LONGITUDE), as written by the
+pipeline. The casts' positions and row ranges are saved next to the table as
+<stem>.stations.npy and <stem>.stations.json, built once by reading only the two
+position columns, together with the arrays of a haversine BallTree over them
+(<stem>.stations.tree.npz) that answers radius and k-nearest-cast queries:
+
+    python station_index.py Train_data.csv --near -55.0 72.9 --radius 50
+    python station_index.py Train_data.csv --near -55.0 72.9 --k 5
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import sklearn
+
+from conversion_functions import station_starts
+from manifest import atomic_open, file_fingerprint, fingerprint_matches, save_npy, write_json
+from table_io import read_table
+from tree_state import TREE_STATE_ARRAYS, restore_tree, tree_state
+
+# Bump whenever the layout of the index files changes, so old indexes are rebuilt
+STATION_INDEX_VERSION = 1
+# Mean Earth radius (IUGG), km
+EARTH_RADIUS_KM = 6371.0088
+
+STATION_DTYPE = np.dtype([('latitude', 'f8'), ('longitude', 'f8'), ('first_row', 'i8'), ('n_rows', 'i8')])
+# Query results: the cast and its great-circle distance to the query point
+MATCH_DTYPE = np.dtype(STATION_DTYPE.descr + [('distance_km', 'f8')])
+
+
+def station_paths(table_path, index_dir=None):
+    """<stem>.stations.npy and <stem>.stations.json of table_path, next to it unless index_dir is given."""
+    table_path = Path(table_path)
+    folder = Path(index_dir) if index_dir else table_path.parent
+    return {
+        'stations': folder / f"{table_path.stem}.stations.npy",
+        'tree': folder / f"{table_path.stem}.stations.tree.npz",
+        'meta': folder / f"{table_path.stem}.stations.json",
+    }
+
+
+def find_stations(lat, lon):
+    """
+    Casts of a table given its LATITUDE and LONGITUDE columns (1-D arrays in table order),
+    as a STATION_DTYPE array; casts with a NaN position are left out.
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    starts = station_starts(lon, lat)
+    stations = np.empty(len(starts), dtype=STATION_DTYPE)
+    stations['latitude'], stations['longitude'] = lat[starts], lon[starts]
+    stations['first_row'] = starts
+    stations['n_rows'] = np.diff(starts, append=len(lat))
+    return stations[~(np.isnan(stations['latitude']) | np.isnan(stations['longitude']))]
+
+
+def _ball_tree(stations):
+    from sklearn.neighbors import BallTree
+    return BallTree(np.radians(np.column_stack([stations['latitude'], stations['longitude']])), metric='haversine')
+
+
+def build_station_index(table_path, index_dir=None):
+    """
+    Find the casts of table_path (rows with a NaN position are skipped) and save them as
+    a STATION_DTYPE array, with the arrays of their BallTree, plus a JSON description
+    holding the source's size, mtime and SHA-256. The JSON is written last. Returns the
+    description (dict).
+    """
+    paths = station_paths(table_path, index_dir)
+    paths['meta'].parent.mkdir(parents=True, exist_ok=True)
+    fingerprint = file_fingerprint(table_path, prefix='source_')
+
+    df = read_table(table_path, columns=['LATITUDE', 'LONGITUDE'])
+    lat, lon = df['LATITUDE'].to_numpy(dtype=np.float64), df['LONGITUDE'].to_numpy(dtype=np.float64)
+    del df
+    stations = find_stations(lat, lon)
+
+    arrays, params = tree_state(_ball_tree(stations))
+
+    paths['meta'].unlink(missing_ok=True)
+    save_npy(paths['stations'], stations)
+    with atomic_open(paths['tree'], 'wb') as f:
+        np.savez(f, **dict(zip(TREE_STATE_ARRAYS, arrays)))
+    meta = {
+        'index_version': STATION_INDEX_VERSION,
+        'source': Path(table_path).name,
+        **fingerprint,
+        'rows': len(lat),
+        'stations': len(stations),
+        'sites': int(len(np.unique(stations[['latitude', 'longitude']]))),
+        'sklearn_version': sklearn.__version__,
+        'tree': params,
+    }
+    write_json(paths['meta'], meta)
+    return meta
+
+
+def is_station_index_fresh(table_path, meta):
+    """True if meta describes the index of the current content of table_path."""
+    if meta is None or meta.get('index_version') != STATION_INDEX_VERSION:
+        return False
+    return fingerprint_matches(table_path, meta, prefix='source_', missing_ok=True)
+
+
+class StationIndex:
+    """
+    Casts of a final table with a haversine BallTree over their positions. Use
+    StationIndex.load(); queries take degrees and kilometres and return MATCH_DTYPE
+    arrays sorted by distance, whose first_row / n_rows locate each cast's rows in the table.
+    """
+
+    def __init__(self, stations, meta=None, tree=None):
+        self.stations = stations
+        self.meta = meta
+        self.tree = tree if tree is not None else _ball_tree(stations)
+
+    @classmethod
+    def load(cls, table_path, index_dir=None, build=True):
+        """The index of table_path, (re)built first if it is missing or stale and build=True."""
+        paths = station_paths(table_path, index_dir)
+        meta = None
+        if all(path.exists() for path in paths.values()):
+            with open(paths['meta'], 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        if not is_station_index_fresh(table_path, meta):
+            if not build:
+                raise FileNotFoundError(f"No up-to-date station index for {table_path}")
+            meta = build_station_index(table_path, index_dir)
+        from sklearn.neighbors import BallTree
+        with np.load(paths['tree']) as arrays:
+            tree = restore_tree(BallTree, [arrays[name] for name in TREE_STATE_ARRAYS], meta['tree'],
+                                meta['sklearn_version'], metric='haversine')
+        return cls(np.load(paths['stations']), meta, tree)
+
+    def _matches(self, indices, distances):
+        matches = np.empty(len(indices), dtype=MATCH_DTYPE)
+        for name in STATION_DTYPE.names:
+            matches[name] = self.stations[name][indices]
+        matches['distance_km'] = distances * EARTH_RADIUS_KM
+        return matches
+
+    def within(self, lat, lon, radius_km):
+        """Casts within radius_km of (lat, lon), nearest first."""
+        indices, distances = self.tree.query_radius(np.radians([[lat, lon]]), r=radius_km / EARTH_RADIUS_KM,
+                                                    return_distance=True, sort_results=True)
+        return self._matches(indices[0], distances[0])
+
+    def nearest(self, lat, lon, k=1):
+        """The k casts nearest to (lat, lon), nearest first."""
+        distances, indices = self.tree.query(np.radians([[lat, lon]]), k=min(k, len(self.stations)))
+        return self._matches(indices[0], distances[0])
+
+    def nearest_many(self, lat, lon, k=1):
+        """
+        Indices into self.stations and distances (km) of the k casts nearest to each of
+        the points given by 1-D arrays lat and lon: two (points, k) arrays.
+        """
+        distances, indices = self.tree.query(np.radians(np.column_stack([lat, lon])), k=min(k, len(self.stations)))
+        return indices, distances * EARTH_RADIUS_KM
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the station index of a final table, and look up casts near a point.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--index_dir', type=str, default=None, help='Folder for the index files (default: next to the table)')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the index is up to date')
+    parser.add_argument('--near', type=float, nargs=2, metavar=('LAT', 'LON'), default=None, help='Query point, degrees')
+    parser.add_argument('--radius', type=float, default=None, help='Casts within this many km of the query point')
+    parser.add_argument('--k', type=int, default=5, help='Nearest casts to list when no --radius is given')
+    args = parser.parse_args()
+
+    if args.force:
+        build_station_index(args.table, args.index_dir)
+    index = StationIndex.load(args.table, args.index_dir)
+    print(f"{index.meta['stations']} casts at {index.meta['sites']} sites in {index.meta['rows']} rows")
+    if args.near:
+        start = time.perf_counter()
+        if args.radius is not None:
+            matches = index.within(*args.near, args.radius)
+        else:
+            matches = index.nearest(*args.near, args.k)
+        print(f"{len(matches)} casts found in {(time.perf_counter() - start) * 1e3:.3f} ms")
+        for m in matches:
+            print(f"  {m['latitude']:9.4f} {m['longitude']:10.4f}  {m['distance_km']:9.2f} km  "
+                  f"rows {m['first_row']}..{m['first_row'] + m['n_rows'] - 1}")
@@ -0,0 +1,89 @@
+import pandas as pd
+from pathlib import Path
+
+# Processed shards and pipeline outputs are stored as CSV or as zstd-compressed Parquet;
+# the file suffix decides which.
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+PARQUET_COMPRESSION = 'zstd'
+
+
+def is_parquet(path):
+    return Path(path).suffix.lower() in PARQUET_SUFFIXES
+
+
+def read_table(path, columns=None):
+    """Read a CSV or Parquet file into a DataFrame, based on the file suffix."""
+    if is_parquet(path):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def write_table(df, path):
+    """Write a DataFrame as CSV or Parquet, based on the file suffix."""
+    if is_parquet(path):
+        df.to_parquet(path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path, index=False)
+
+
+class TableWriter:
+    """
+    Incremental writer: DataFrames passed to write() are appended to one CSV or Parquet
+    file, so callers never need to hold the whole table in memory. All chunks must have
+    the same columns; for Parquet the schema is fixed by the first chunk and small chunks
+    are buffered up to row_group_size rows per row group.
+    """
+
+    def __init__(self, path, row_group_size=256_000):
+        self.path = Path(path)
+        self.rows = 0
+        self.row_group_size = row_group_size
+        self._parquet = is_parquet(path)
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = None
+        self._file = None
+
+    def write(self, df):
+        if self._parquet:
+            self._pending.append(df)
+            self._pending_rows += len(df)
+            if self._pending_rows >= self.row_group_size:
+                self._flush()
+        else:
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='', encoding='utf-8')
+                # Header is written with the first chunk
+                df.to_csv(self._file, index=False)
+            else:
+                df.to_csv(self._file, header=False, index=False)
+        self.rows += len(df)
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        df = self._pending[0] if len(self._pending) == 1 else pd.concat(self._pending, ignore_index=True)
+        self._pending = []
+        self._pending_rows = 0
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression=PARQUET_COMPRESSION)
+        else:
+            table = pa.Table.from_pandas(df, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._pending:
+            self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,83 @@
+"""
+Fused TEOS-10 kernel: depth, Absolute Salinity, Conservative Temperature and sound
+speed in one compiled loop over the rows, written straight into preallocated float64
+output columns. Requires numba (optional dependency, `pip install numba`).
+
+The kernel calls the C functions of the GSW library that the gsw package is built
+from (gsw_z_from_p, gsw_sa_from_sp, gsw_ct_from_t, gsw_sound_speed), so results match
+the gsw ufuncs exactly; it only removes the four full-length intermediate arrays and
+the per-call ufunc overhead. It finds those functions in the gsw extension module
+itself, which exports them on Linux and macOS; a Windows build (.pyd) does not, and
+importing this module raises ImportError there (use kernel="gsw").
+"""
+import ctypes
+
+import numba
+import numpy as np
+import gsw._gsw_ufuncs
+
+# Returned by the GSW C library for out-of-range input; the gsw ufuncs turn it into NaN
+GSW_INVALID_VALUE = 9e15
+
+
+def _c_function(library, name, n_args):
+    func = getattr(library, name)
+    func.argtypes = [ctypes.c_double] * n_args
+    func.restype = ctypes.c_double
+    return func
+
+
+try:
+    _libgsw = ctypes.CDLL(gsw._gsw_ufuncs.__file__)
+    _z_from_p = _c_function(_libgsw, "gsw_z_from_p", 4)
+    _sa_from_sp = _c_function(_libgsw, "gsw_sa_from_sp", 4)
+    _ct_from_t = _c_function(_libgsw, "gsw_ct_from_t", 3)
+    _sound_speed = _c_function(_libgsw, "gsw_sound_speed", 3)
+except (OSError, AttributeError) as error:
+    raise ImportError(f"The numba TEOS-10 kernel needs the GSW C functions exported by {gsw._gsw_ufuncs.__file__}, "
+                      f"which this gsw build does not export (Windows builds never do); use kernel='gsw'") from error
+
+
+@numba.njit(inline="always")
+def _valid(value):
+    return np.nan if value == GSW_INVALID_VALUE else value
+
+
+# Not cached on disk: numba cannot cache functions that call ctypes pointers
+@numba.njit(parallel=True)
+def _teos10_rows(p, t, SP, lon, lat, depth_m, SA, CT, c):
+    for i in numba.prange(len(p)):
+        # NaN in, NaN out, as in the gsw ufuncs; each step only sees its own inputs
+        p_i = p[i]
+        if np.isnan(p_i) or np.isnan(lat[i]):
+            depth_m[i] = np.nan
+        else:
+            depth_m[i] = -_valid(_z_from_p(p_i, lat[i], 0.0, 0.0))
+        if np.isnan(p_i) or np.isnan(SP[i]) or np.isnan(lon[i]) or np.isnan(lat[i]):
+            sa = np.nan
+        else:
+            sa = _valid(_sa_from_sp(SP[i], p_i, lon[i], lat[i]))
+        ct = np.nan if np.isnan(sa) or np.isnan(t[i]) else _valid(_ct_from_t(sa, t[i], p_i))
+        SA[i] = sa
+        CT[i] = ct
+        c[i] = np.nan if np.isnan(ct) else _valid(_sound_speed(sa, ct, p_i))
+
+
+def teos10_fused(p, t, SP, lon, lat, workers=None):
+    """
+    Depth, Absolute Salinity, Conservative Temperature and sound speed for 1-D arrays
+    of pressure (dbar), in-situ temperature, Practical Salinity, lon and lat, in one
+    pass over the rows on `workers` numba threads (default: numba's thread count).
+    Returns (depth_m, SA, CT, sound_speed), like conversion_functions.teos10_columns().
+    """
+    p, t, SP, lon, lat = (np.ascontiguousarray(a, dtype=np.float64) for a in (p, t, SP, lon, lat))
+    n = len(p)
+    depth_m, SA, CT, c = (np.empty(n, dtype=np.float64) for _ in range(4))
+    previous = numba.get_num_threads()
+    if workers:
+        numba.set_num_threads(min(workers, numba.config.NUMBA_NUM_THREADS))
+    try:
+        _teos10_rows(p, t, SP, lon, lat, depth_m, SA, CT, c)
+    finally:
+        numba.set_num_threads(previous)
+    return depth_m, SA, CT, c
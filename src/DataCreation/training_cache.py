@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from manifest import file_fingerprint, fingerprint_matches, save_npy, write_json
+from table_io import read_table
+
+# Bump whenever the layout of the cache files changes, so old caches are rebuilt
+CACHE_VERSION = 1
+
+# Model inputs, in the column order of the final TEOS-10 table (the notebooks use
+# df.drop(columns=["sound_speed"])), and the regression target
+FEATURE_COLUMNS = ["LATITUDE", "LONGITUDE", "CTDPRS", "CTDTMP", "CTDSAL", "depth_m", "SA", "CT"]
+TARGET_COLUMN = "sound_speed"
+
+
+def cache_paths(table_path, cache_dir=None):
+    """
+    Files of the training-matrix cache of table_path, next to it unless cache_dir is given:
+    <stem>.features.npy (rows x FEATURE_COLUMNS), <stem>.target.npy and <stem>.cache.json.
+    """
+    table_path = Path(table_path)
+    folder = Path(cache_dir) if cache_dir else table_path.parent
+    stem = table_path.stem
+    return {
+        'features': folder / f"{stem}.features.npy",
+        'target': folder / f"{stem}.target.npy",
+        'meta': folder / f"{stem}.cache.json",
+    }
+
+
+def content_hash(X, y):
+    """SHA-256 over the shapes, dtypes and bytes of the feature matrix and target vector."""
+    digest = hashlib.sha256()
+    for a in (X, y):
+        digest.update(f"{a.dtype.str}{a.shape}".encode())
+        digest.update(np.ascontiguousarray(a).data)
+    return digest.hexdigest()
+
+
+def build_training_cache(table_path, cache_dir=None, dtype=np.float64):
+    """
+    Turn the final TEOS-10 table (CSV or Parquet) into a C-contiguous feature matrix and
+    a target vector saved as .npy, plus a JSON description holding the source's size,
+    mtime and SHA-256 and the content hash of the arrays. Rows with NaNs are dropped, as
+    the notebooks' .dropna() does. Every file is written to a temporary name first and
+    renamed, the JSON last, so a half-written cache is never picked up.
+    Returns the cache description (dict).
+    """
+    paths = cache_paths(table_path, cache_dir)
+    paths['meta'].parent.mkdir(parents=True, exist_ok=True)
+    fingerprint = file_fingerprint(table_path, prefix='source_')
+
+    df = read_table(table_path).dropna()
+    X = np.ascontiguousarray(df[FEATURE_COLUMNS].to_numpy(dtype=dtype))
+    y = df[TARGET_COLUMN].to_numpy(dtype=dtype)
+    del df
+
+    paths['meta'].unlink(missing_ok=True)
+    save_npy(paths['features'], X)
+    save_npy(paths['target'], y)
+    meta = {
+        'cache_version': CACHE_VERSION,
+        'source': Path(table_path).name,
+        **fingerprint,
+        'features': FEATURE_COLUMNS,
+        'target': TARGET_COLUMN,
+        'rows': int(X.shape[0]),
+        'dtype': np.dtype(dtype).name,
+        'content_sha256': content_hash(X, y),
+    }
+    write_json(paths['meta'], meta)
+    return meta
+
+
+def read_cache_meta(table_path, cache_dir=None):
+    """The cache description of table_path, or None if there is no complete cache."""
+    paths = cache_paths(table_path, cache_dir)
+    if not all(path.exists() for path in paths.values()):
+        return None
+    with open(paths['meta'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def is_cache_fresh(table_path, meta, dtype=None):
+    """
+    True if meta describes a cache of the current content of table_path (and of dtype, if
+    given): size and mtime match, or the source's SHA-256 still matches after a touch/copy.
+    """
+    if meta is None or meta.get('cache_version') != CACHE_VERSION:
+        return False
+    if dtype is not None and meta['dtype'] != np.dtype(dtype).name:
+        return False
+    # Only the cache was shipped: trust it
+    return fingerprint_matches(table_path, meta, prefix='source_', missing_ok=True)
+
+
+def load_training_cache(table_path, cache_dir=None, dtype=None, build=True, mmap_mode='r', verify=False):
+    """
+    Load the training matrix of table_path without parsing the table: returns (X, y, meta)
+    with X (rows x FEATURE_COLUMNS) and y memory-mapped read-only from the .npy files, so
+    loading takes milliseconds and pages are only read when touched. The cache is
+    (re)built first when it is missing or stale and build=True (dtype defaults to
+    float64 then). verify=True re-hashes the arrays against meta['content_sha256'].
+    """
+    meta = read_cache_meta(table_path, cache_dir)
+    if not is_cache_fresh(table_path, meta, dtype):
+        if not build:
+            raise FileNotFoundError(f"No up-to-date training cache for {table_path}")
+        meta = build_training_cache(table_path, cache_dir, dtype or np.float64)
+
+    paths = cache_paths(table_path, cache_dir)
+    if Path(table_path).exists() and os.stat(table_path).st_mtime_ns != meta['source_mtime_ns']:
+        # Same content with a new mtime: remember it so the next check is a stat only
+        meta['source_mtime_ns'] = os.stat(table_path).st_mtime_ns
+        write_json(paths['meta'], meta)
+    X = np.load(paths['features'], mmap_mode=mmap_mode)
+    y = np.load(paths['target'], mmap_mode=mmap_mode)
+    if verify and content_hash(X, y) != meta['content_sha256']:
+        raise ValueError(f"Training cache of {table_path} does not match its content hash")
+    return X, y, meta
+
+
+class ShuffledBatches:
+    """
+    Mini-batches of (X, y) over one epoch each time it is iterated, for arrays such as the
+    memory-mapped cache. With shuffle, one permutation per epoch gathers the rows into
+    buffers allocated once, and the batches are contiguous slices of those buffers, so
+    there is no per-row indexing or collation; without it, the batches are slices of X
+    and y themselves. convert (e.g. torch.from_numpy) is applied to every batch, a view.
+    A batch is only valid until the next epoch starts.
+    """
+
+    def __init__(self, X, y, batch_size, shuffle=True, seed=None, convert=None):
+        self.X, self.y = X, y
+        # len(loader.dataset) is the number of rows, as for a DataLoader
+        self.dataset = X
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.convert = convert or (lambda a: a)
+        self._buffers = None
+
+    def __len__(self):
+        return -(-len(self.X) // self.batch_size)
+
+    def __iter__(self):
+        X, y = self.X, self.y
+        if self.shuffle:
+            if self._buffers is None:
+                self._buffers = (np.empty(X.shape, dtype=X.dtype), np.empty(y.shape, dtype=y.dtype))
+            order = self.rng.permutation(len(X))
+            # A permutation is always in range; mode='raise' would gather into a full-size
+            # temporary first and copy it into out
+            X = np.take(X, order, axis=0, out=self._buffers[0], mode='wrap')
+            y = np.take(y, order, axis=0, out=self._buffers[1], mode='wrap')
+        for start in range(0, len(X), self.batch_size):
+            yield self.convert(X[start:start + self.batch_size]), self.convert(y[start:start + self.batch_size])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped training-matrix cache of a final TEOS-10 table.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Folder for the cache files (default: next to the table)')
+    parser.add_argument('--float32', action='store_true', help='Store the matrix as float32 instead of float64')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the cache is up to date')
+    args = parser.parse_args()
+    dtype = np.float32 if args.float32 else np.float64
+    meta = read_cache_meta(args.table, args.cache_dir)
+    if args.force or not is_cache_fresh(args.table, meta, dtype):
+        meta = build_training_cache(args.table, args.cache_dir, dtype)
+        print(f"Training cache built: {meta['rows']} rows x {len(meta['features'])} features ({meta['dtype']})")
+    else:
+        print("Training cache is up to date")
+    print(f"  {cache_paths(args.table, args.cache_dir)['features']}")
@@ -0,0 +1,39 @@
+"""
+Saving and restoring sklearn's KDTree / BallTree without rebuilding them.
+
+A fitted tree is a few arrays plus three integers (its __getstate__()), so an index can
+keep the arrays as .npy files and put the tree back together around them, memory-mapped,
+in milliseconds. The state layout is private to sklearn: restore_tree() only reuses it
+when the index was written by the sklearn version running now, and rebuilds the tree
+(deterministic, the same tree) otherwise.
+"""
+import sklearn
+
+# Arrays and parameters of the BinaryTree state, in state order
+TREE_STATE_ARRAYS = ('data', 'idx_array', 'node_data', 'node_bounds')
+TREE_STATE_PARAMS = ('leaf_size', 'n_levels', 'n_nodes')
+# Position of the distance-metric object in the state
+_METRIC_FIELD = 11
+
+
+def tree_state(tree):
+    """The arrays (tuple, in TREE_STATE_ARRAYS order) and parameters (dict) of a fitted tree."""
+    state = tree.__getstate__()
+    return state[:len(TREE_STATE_ARRAYS)], {name: int(value) for name, value in zip(TREE_STATE_PARAMS, state[4:7])}
+
+
+def restore_tree(tree_class, arrays, params, sklearn_version, **kwargs):
+    """
+    The tree_class (KDTree or BallTree) saved by tree_state() as arrays (in
+    TREE_STATE_ARRAYS order, e.g. memory maps) and params (a mapping holding
+    TREE_STATE_PARAMS) with sklearn sklearn_version. kwargs are the tree's constructor
+    arguments besides leaf_size (e.g. metric='haversine').
+    """
+    if sklearn_version != sklearn.__version__:
+        return tree_class(arrays[0], leaf_size=params['leaf_size'], **kwargs)
+    # A throw-away tree on one point supplies the metric object of this sklearn build
+    metric = tree_class(arrays[0][:1], leaf_size=params['leaf_size'], **kwargs).__getstate__()[_METRIC_FIELD]
+    tree = tree_class.__new__(tree_class)
+    # Query counters start at 0, no sample weights
+    tree.__setstate__(tuple(arrays) + tuple(params[name] for name in TREE_STATE_PARAMS) + (0, 0, 0, 0, metric, None))
+    return tree
@@ -0,0 +1,264 @@
+"""
+CPU inference for the saved DNN (DNN_model.pth): the 320-160-160-80-40-1 MLP of
+exps_notebooks/DNN.ipynb, served with NumPy in large vectorized batches.
+
+The weights are loaded once and folded at load time:
+  - the input StandardScaler goes into the first Linear layer,
+  - every eval-mode BatchNorm1d goes into the Linear layer after it,
+so a prediction is five matmul + bias + ReLU steps and a final matmul, written into
+buffers preallocated per batch. torch is not needed: the checkpoint's zip/pickle
+format is read directly.
+
+    python dnn_inference.py Train_data.parquet predictions.parquet --batch_size 65536
+"""
+import argparse
+import collections
+import os
+import pickle
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from table_io import TableWriter, is_parquet
+from training_cache import FEATURE_COLUMNS
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WEIGHTS = os.path.join(MODEL_DIR, 'DNN_model.pth')
+# The KNN pipeline's StandardScaler was fit on the same train_test_split(test_size=0.2,
+# random_state=42) training rows as the scaler the DNN was trained with (KNN.ipynb and
+# DNN.ipynb), so it is the scaler the DNN expects
+DEFAULT_SCALER = os.path.join(MODEL_DIR, 'KNN_model.joblib')
+
+PREDICTION_COLUMN = 'Predicted_Sound_Speed'
+# nn.BatchNorm1d default
+BATCHNORM_EPS = 1e-5
+
+# torch storage classes in the checkpoint pickle -> NumPy dtypes
+_STORAGE_DTYPES = {
+    'FloatStorage': np.float32,
+    'DoubleStorage': np.float64,
+    'HalfStorage': np.float16,
+    'LongStorage': np.int64,
+    'IntStorage': np.int32,
+}
+
+
+def _rebuild_tensor(storage, storage_offset, size, stride, requires_grad=False, backward_hooks=None,
+                    metadata=None):
+    itemsize = storage.dtype.itemsize
+    return np.lib.stride_tricks.as_strided(storage[storage_offset:], shape=tuple(size),
+                                           strides=tuple(s * itemsize for s in stride)).copy()
+
+
+class _StateDictUnpickler(pickle.Unpickler):
+    """Unpickles a torch state_dict into NumPy arrays; refuses any other class."""
+
+    def __init__(self, file, archive, prefix):
+        super().__init__(file)
+        self.archive = archive
+        self.prefix = prefix
+
+    def find_class(self, module, name):
+        if module == 'collections' and name == 'OrderedDict':
+            return collections.OrderedDict
+        if module == 'torch._utils' and name == '_rebuild_tensor_v2':
+            return _rebuild_tensor
+        if module == 'torch' and name in _STORAGE_DTYPES:
+            return np.dtype(_STORAGE_DTYPES[name])
+        raise pickle.UnpicklingError(f"Unexpected object {module}.{name} in a state_dict checkpoint")
+
+    def persistent_load(self, pid):
+        # ('storage', storage class, key, location, number of elements)
+        _, dtype, key, _, numel = pid
+        data = self.archive.read(f"{self.prefix}/data/{key}")
+        return np.frombuffer(data, dtype=dtype.newbyteorder('<'), count=numel)
+
+
+def load_state_dict(path):
+    """{parameter name: ndarray} of a state_dict saved with torch.save (zip format)."""
+    with zipfile.ZipFile(path) as archive:
+        pickle_name = next(name for name in archive.namelist() if name.endswith('/data.pkl'))
+        prefix = pickle_name[:-len('/data.pkl')]
+        byteorder = f"{prefix}/byteorder"
+        if byteorder in archive.namelist() and archive.read(byteorder).strip() != b'little':
+            raise ValueError(f"{path}: only little-endian checkpoints are supported")
+        with archive.open(pickle_name) as f:
+            return _StateDictUnpickler(f, archive, prefix).load()
+
+
+def sequential_layers(state_dict, prefix='fc'):
+    """
+    The layers of an nn.Sequential of Linear / ReLU / BatchNorm1d from its state_dict, in
+    order: ('linear', W, b), ('batchnorm', scale, shift) in its eval-mode form
+    x * scale + shift, or ('relu',) for the parameter-less indices in between.
+    """
+    indices = sorted({int(name.split('.')[1]) for name in state_dict if name.startswith(prefix + '.')})
+    layers = []
+    for i in range(indices[-1] + 1):
+        key = f"{prefix}.{i}."
+        if key + 'running_mean' in state_dict:
+            gamma, beta = (state_dict[key + p].astype(np.float64) for p in ('weight', 'bias'))
+            mean, var = (state_dict[key + p].astype(np.float64) for p in ('running_mean', 'running_var'))
+            scale = gamma / np.sqrt(var + BATCHNORM_EPS)
+            layers.append(('batchnorm', scale, beta - mean * scale))
+        elif key + 'weight' in state_dict:
+            layers.append(('linear', state_dict[key + 'weight'].astype(np.float64),
+                           state_dict[key + 'bias'].astype(np.float64)))
+        else:
+            layers.append(('relu',))
+    return layers
+
+
+def fuse_layers(layers, mean=None, scale=None):
+    """
+    Fold the input standardization (x - mean) / scale and every BatchNorm into the
+    neighbouring Linear layers. Returns [(W, b, relu)], one entry per Linear layer,
+    computing relu(x @ W + b) (or x @ W + b) in float64.
+    """
+    fused = []
+    pending = None      # affine (scale, shift) waiting to be folded into the next Linear
+    if mean is not None:
+        pending = (1.0 / np.asarray(scale, dtype=np.float64), -np.asarray(mean, dtype=np.float64) / scale)
+    for layer in layers:
+        kind = layer[0]
+        if kind == 'linear':
+            W, b = layer[1], layer[2]
+            if pending is not None:
+                # W (a x + c) + b = (W a) x + (W c + b)
+                b = W @ pending[1] + b
+                W = W * pending[0][None, :]
+                pending = None
+            fused.append([W.T.copy(), b, False])
+        elif kind == 'relu':
+            fused[-1][2] = True
+        elif fused and not fused[-1][2] and pending is None:
+            # BatchNorm right after a Linear: scale its outputs
+            a, c = layer[1], layer[2]
+            fused[-1][0] = fused[-1][0] * a[None, :]
+            fused[-1][1] = fused[-1][1] * a + c
+        else:
+            pending = (layer[1], layer[2]) if pending is None else (pending[0] * layer[1], pending[1] * layer[1] + layer[2])
+    if pending is not None:
+        raise ValueError("A BatchNorm layer after the last Linear layer cannot be fused")
+    return [tuple(layer) for layer in fused]
+
+
+def load_scaler(path):
+    """(mean, scale, feature names or None) of a joblib StandardScaler or of a Pipeline's 'scaler' step."""
+    import joblib
+    scaler = joblib.load(path)
+    if hasattr(scaler, 'named_steps'):
+        scaler = scaler.named_steps['scaler']
+    names = getattr(scaler, 'feature_names_in_', None)
+    return scaler.mean_, scaler.scale_, (list(names) if names is not None else None)
+
+
+class DNNPredictor:
+    """
+    Batched CPU predictor for DNN_model.pth. Weights and scaler are loaded and fused
+    once; predict() runs the network on batch_size rows at a time in `dtype` (float32,
+    as the model was trained, or float64) with no allocations inside the batch loop.
+    """
+
+    def __init__(self, weights=DEFAULT_WEIGHTS, scaler=DEFAULT_SCALER, dtype=np.float32, batch_size=65536):
+        mean, scale, names = load_scaler(scaler)
+        self.features = names or list(FEATURE_COLUMNS)
+        self.dtype = np.dtype(dtype)
+        self.batch_size = batch_size
+        self.layers = [(np.ascontiguousarray(W, dtype=self.dtype), b.astype(self.dtype), relu)
+                       for W, b, relu in fuse_layers(sequential_layers(load_state_dict(weights)), mean, scale)]
+        if self.layers[0][0].shape[0] != len(self.features):
+            raise ValueError(f"Model expects {self.layers[0][0].shape[0]} features, scaler has {len(self.features)}")
+        self._buffers = None
+        self.latencies = []
+
+    def _batch_buffers(self, rows):
+        if self._buffers is None or self._buffers[0].shape[0] < rows:
+            self._buffers = [np.empty((rows, W.shape[1]), dtype=self.dtype) for W, _, _ in self.layers]
+        return [buf[:rows] for buf in self._buffers]
+
+    def predict_batch(self, X):
+        """Predictions (1-D float64) for one batch, a 2-D array with the model's feature columns."""
+        x = np.asarray(X, dtype=self.dtype)
+        for (W, b, relu), out in zip(self.layers, self._batch_buffers(len(x))):
+            np.matmul(x, W, out=out)
+            out += b
+            if relu:
+                np.maximum(out, 0, out=out)
+            x = out
+        return x[:, 0].astype(np.float64)
+
+    def predict(self, X):
+        """
+        Predictions (1-D float64) for X, an array or DataFrame (columns picked by name),
+        in batches of batch_size rows; each batch's latency is appended to self.latencies.
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[self.features].to_numpy()
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), self.batch_size):
+            stop = min(start + self.batch_size, len(X))
+            t0 = time.perf_counter()
+            out[start:stop] = self.predict_batch(X[start:stop])
+            self.latencies.append(time.perf_counter() - t0)
+        return out
+
+    def report(self, rows, seconds):
+        """rows/sec over `seconds` and p50 / p99 latency of the batches recorded so far."""
+        lat = np.array(self.latencies) * 1e3
+        return (f"{rows} rows in {seconds:.2f} s ({rows / seconds:,.0f} rows/s), "
+                f"{len(lat)} batches of <= {self.batch_size}: "
+                f"p50 {np.percentile(lat, 50):.2f} ms, p99 {np.percentile(lat, 99):.2f} ms")
+
+
+def iter_table_chunks(path, chunk_rows):
+    """Read a CSV or Parquet file in DataFrames of about chunk_rows rows."""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def predict_table(predictor, input_path, output_path, chunk_rows=1_000_000):
+    """
+    Stream input_path (CSV or Parquet) through the predictor in chunks of chunk_rows and
+    write every input row with a PREDICTION_COLUMN to output_path. Rows with a NaN
+    feature get a NaN prediction. Returns the number of rows written.
+    """
+    with TableWriter(output_path) as out:
+        for df in iter_table_chunks(input_path, chunk_rows):
+            X = df[predictor.features].to_numpy()
+            ok = ~np.isnan(X).any(axis=1)
+            pred = np.full(len(df), np.nan)
+            pred[ok] = predictor.predict(X[ok])
+            out.write(df.assign(**{PREDICTION_COLUMN: pred}))
+        return out.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched CPU inference with the saved DNN over a CSV or Parquet file.")
+    parser.add_argument('input', type=str, help='CSV or Parquet file with the model features')
+    parser.add_argument('output', type=str, help='CSV or Parquet file: the input rows plus ' + PREDICTION_COLUMN)
+    parser.add_argument('--weights', type=str, default=DEFAULT_WEIGHTS, help='DNN state_dict (.pth)')
+    parser.add_argument('--scaler', type=str, default=DEFAULT_SCALER,
+                        help='joblib StandardScaler, or Pipeline with a "scaler" step, fit on the training features')
+    parser.add_argument('--batch_size', type=int, default=65536, help='Rows per forward pass')
+    parser.add_argument('--chunk_rows', type=int, default=1_000_000, help='Rows read from the input at a time')
+    parser.add_argument('--float64', action='store_true', help='Run the network in float64 instead of float32')
+    args = parser.parse_args()
+
+    predictor = DNNPredictor(args.weights, args.scaler, np.float64 if args.float64 else np.float32, args.batch_size)
+    start = time.perf_counter()
+    rows = predict_table(predictor, args.input, args.output, args.chunk_rows)
+    print(f"Predictions written to {args.output}")
+    print(predictor.report(rows, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
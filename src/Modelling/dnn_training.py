@@ -0,0 +1,249 @@
+"""
+K-fold cross-validation of the DNN (exps_notebooks/DNN.ipynb) with the folds trained
+concurrently, one process per fold, each limited to a few torch threads.
+
+As in the notebook, the training split is train_test_split(test_size=0.2,
+random_state=42) of the final table and the folds are KFold(n_splits, shuffle=True,
+random_state=42) of it, each with its own StandardScaler. The parent standardizes
+every fold once and writes its matrices as float32 .npy files to shared memory
+(/dev/shm when available); the fold processes map them copy-on-write and wrap them
+with torch.from_numpy, so no fold matrix is copied or pickled to a worker. Batches come
+from training_cache.ShuffledBatches: one permutation per epoch gathers the rows into a
+buffer and the batches are contiguous slices of it, instead of the DataLoader's
+per-row indexing and collation (use_dataloader=True / --dataloader for the notebook's).
+
+    python dnn_training.py Train_data.csv --folds 5 --workers 5 --histories histories.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from training_cache import ShuffledBatches, load_training_cache
+
+# Hyper-parameters of DNN.ipynb
+LEARNING_RATE = 0.0012
+# BATCH_SIZE = int(len(X_train) / BATCH_DIVISOR)
+BATCH_DIVISOR = 457.76
+PATIENCE = 5
+MIN_DELTA = 0.1
+MAX_EPOCHS = 20
+SPLIT_SEED = 42
+
+HISTORY_KEYS = ("train_loss", "val_loss", "val_mae", "val_mse", "val_rmse", "val_r2")
+FOLD_ARRAYS = ("X_train", "y_train", "X_val", "y_val")
+
+
+class DNN(nn.Module):
+    """The notebook's 320-160-160-80-40-1 MLP (Linear -> ReLU -> BatchNorm1d blocks)."""
+
+    def __init__(self, input_size):
+        super().__init__()
+        self.fc = nn.Sequential(
+            nn.Linear(input_size, 320), nn.ReLU(), nn.BatchNorm1d(320),
+            nn.Linear(320, 160), nn.ReLU(), nn.BatchNorm1d(160),
+            nn.Linear(160, 160), nn.ReLU(), nn.BatchNorm1d(160),
+            nn.Linear(160, 80), nn.ReLU(), nn.BatchNorm1d(80),
+            nn.Linear(80, 40), nn.ReLU(), nn.BatchNorm1d(40),
+            nn.Linear(40, 1),
+        )
+
+    def forward(self, x):
+        return self.fc(x)
+
+
+def train_model(model, optimizer, criterion, train_loader, val_loader, patience=PATIENCE, min_delta=MIN_DELTA,
+                max_epochs=MAX_EPOCHS, device="cpu", log=None):
+    """
+    The notebook's training loop with early stopping on the validation loss. Returns the
+    history: {"train_loss", "val_loss", "val_mae", "val_mse", "val_rmse", "val_r2"}, one
+    value per epoch, the validation metrics averaged over batches weighted by batch size.
+    """
+    best_val_loss = float("inf")
+    patience_counter = 0
+    history = {key: [] for key in HISTORY_KEYS}
+    n_train, n_val = len(train_loader.dataset), len(val_loader.dataset)
+
+    for epoch in range(max_epochs):
+        model.train()
+        running_loss = 0.0
+        for xb, yb in train_loader:
+            xb, yb = xb.to(device), yb.to(device)
+            optimizer.zero_grad()
+            preds = model(xb).squeeze()
+            loss = criterion(preds, yb)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * xb.size(0)
+
+        model.eval()
+        sums = dict.fromkeys(HISTORY_KEYS[1:], 0.0)
+        with torch.no_grad():
+            for xb, yb in val_loader:
+                xb, yb = xb.to(device), yb.to(device)
+                preds = model(xb).squeeze()
+                n = xb.size(0)
+                mse = torch.mean((preds - yb) ** 2)
+                ss_total = torch.sum((yb - torch.mean(yb)) ** 2)
+                r2 = 1 - torch.sum((yb - preds) ** 2) / ss_total if ss_total > 0 else torch.tensor(0.0)
+                sums["val_loss"] += criterion(preds, yb).item() * n
+                sums["val_mae"] += torch.mean(torch.abs(preds - yb)).item() * n
+                sums["val_mse"] += mse.item() * n
+                sums["val_rmse"] += torch.sqrt(mse).item() * n
+                sums["val_r2"] += r2.item() * n
+
+        history["train_loss"].append(running_loss / n_train)
+        for key, total in sums.items():
+            history[key].append(total / n_val)
+        if log:
+            log(f"epoch {epoch + 1}: train {history['train_loss'][-1]:.4f}, val {history['val_loss'][-1]:.4f}, "
+                f"RMSE {history['val_rmse'][-1]:.4f}")
+
+        # Early stopping check
+        if history["val_loss"][-1] < best_val_loss - min_delta:
+            best_val_loss = history["val_loss"][-1]
+            patience_counter = 0
+        else:
+            patience_counter += 1
+        if patience_counter >= patience:
+            break
+    return history
+
+
+def shared_memory_dir():
+    """Folder for the fold matrices: tmpfs /dev/shm when the system has it."""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def write_folds(X, y, n_folds, folder):
+    """
+    Standardize the KFold(n_folds, shuffle=True, random_state=42) folds of (X, y) as the
+    notebook does (StandardScaler fit on each fold's training rows) and save each fold's
+    FOLD_ARRAYS as float32 .npy files in folder. Returns one {name: path} per fold.
+    """
+    from sklearn.model_selection import KFold
+    from sklearn.preprocessing import StandardScaler
+    folds = []
+    for fold, (train_index, val_index) in enumerate(KFold(n_splits=n_folds, shuffle=True, random_state=SPLIT_SEED).split(X)):
+        scaler = StandardScaler().fit(X[train_index])
+        arrays = {
+            'X_train': scaler.transform(X[train_index]),
+            'y_train': y[train_index],
+            'X_val': scaler.transform(X[val_index]),
+            'y_val': y[val_index],
+        }
+        paths = {}
+        for name, array in arrays.items():
+            paths[name] = os.path.join(folder, f"fold{fold}.{name}.npy")
+            np.save(paths[name], np.ascontiguousarray(array, dtype=np.float32))
+        folds.append(paths)
+    return folds
+
+
+def _fold_tensors(paths):
+    # Copy-on-write maps: shared pages, writable for torch.from_numpy, never written
+    return {name: torch.from_numpy(np.asarray(np.load(path, mmap_mode='c'))) for name, path in paths.items()}
+
+
+def fold_loaders(paths, batch_size, seed=0, use_dataloader=False):
+    """
+    (train, validation) batch iterables over the memory-mapped fold files: ShuffledBatches
+    yielding tensor views, or the notebook's DataLoader(TensorDataset) with use_dataloader.
+    """
+    if use_dataloader:
+        t = _fold_tensors(paths)
+        return (DataLoader(TensorDataset(t['X_train'], t['y_train']), batch_size=batch_size, shuffle=True),
+                DataLoader(TensorDataset(t['X_val'], t['y_val']), batch_size=batch_size, shuffle=False))
+    a = {name: np.asarray(np.load(path, mmap_mode='c')) for name, path in paths.items()}
+    return (ShuffledBatches(a['X_train'], a['y_train'], batch_size, seed=seed, convert=torch.from_numpy),
+            ShuffledBatches(a['X_val'], a['y_val'], batch_size, shuffle=False, convert=torch.from_numpy))
+
+
+def train_fold(fold, paths, batch_size, threads=1, max_epochs=MAX_EPOCHS, seed=0, verbose=False, use_dataloader=False):
+    """Train and validate one fold from its shared .npy files; returns (fold, history)."""
+    torch.set_num_threads(threads)
+    torch.manual_seed(seed + fold)
+    train_loader, val_loader = fold_loaders(paths, batch_size, seed + fold, use_dataloader)
+
+    model = DNN(input_size=np.load(paths['X_train'], mmap_mode='r').shape[1])
+    optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE)
+    log = (lambda message: print(f"Fold {fold + 1} {message}", flush=True)) if verbose else None
+    history = train_model(model, optimizer, nn.L1Loss(), train_loader, val_loader, max_epochs=max_epochs, log=log)
+    return fold, history
+
+
+def cross_validate(X_train, y_train, n_folds=5, workers=None, threads_per_fold=None, max_epochs=MAX_EPOCHS,
+                   batch_size=None, seed=0, verbose=False, use_dataloader=False):
+    """
+    K-fold cross-validation of the DNN on (X_train, y_train) with up to `workers` folds
+    training at once (default: one per fold, at most one per CPU), each process using
+    threads_per_fold torch threads (default: the CPUs divided between the workers).
+    Returns (all_histories, fold_metrics) in fold order, as in the notebook: one history
+    dict per fold and (final val RMSE, final val R2) per fold.
+    """
+    cpus = os.cpu_count() or 1
+    workers = workers or min(n_folds, cpus)
+    threads_per_fold = threads_per_fold or max(cpus // workers, 1)
+    batch_size = batch_size or int(len(X_train) / BATCH_DIVISOR)
+
+    with tempfile.TemporaryDirectory(prefix='dnn_folds_', dir=shared_memory_dir()) as folder:
+        folds = write_folds(np.asarray(X_train), np.asarray(y_train), n_folds, folder)
+        all_histories = [None] * n_folds
+        # spawn: torch's thread pools do not survive fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+            jobs = [pool.submit(train_fold, fold, paths, batch_size, threads_per_fold, max_epochs, seed, verbose,
+                                use_dataloader)
+                    for fold, paths in enumerate(folds)]
+            for job in jobs:
+                fold, history = job.result()
+                all_histories[fold] = history
+    fold_metrics = [(history["val_rmse"][-1], history["val_r2"][-1]) for history in all_histories]
+    return all_histories, fold_metrics
+
+
+def training_split(table_path, cache_dir=None):
+    """(X_train, y_train) of the final table: the notebook's train_test_split(test_size=0.2, random_state=42)."""
+    from sklearn.model_selection import train_test_split
+    X, y, _ = load_training_cache(table_path, cache_dir)
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=0.2, shuffle=True, random_state=SPLIT_SEED)
+    return X_train, y_train
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel K-fold cross-validation of the DNN on a final table.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--folds', type=int, default=5, help='Number of KFold folds')
+    parser.add_argument('--workers', type=int, default=None, help='Folds trained at once (default: min(folds, CPUs))')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads per fold (default: CPUs / workers)')
+    parser.add_argument('--max_epochs', type=int, default=MAX_EPOCHS, help='Epochs per fold before early stopping')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Folder of the training-matrix cache (default: next to the table)')
+    parser.add_argument('--histories', type=str, default=None, help='JSON file for all_histories and fold_metrics')
+    parser.add_argument('--verbose', action='store_true', help='Print every epoch of every fold')
+    parser.add_argument('--dataloader', action='store_true', help="Batch with the notebook's DataLoader(TensorDataset)")
+    args = parser.parse_args()
+
+    X_train, y_train = training_split(args.table, args.cache_dir)
+    start = time.perf_counter()
+    all_histories, fold_metrics = cross_validate(X_train, y_train, args.folds, args.workers, args.threads,
+                                                 args.max_epochs, verbose=args.verbose, use_dataloader=args.dataloader)
+    print(f"{args.folds} folds in {time.perf_counter() - start:.1f} s")
+    for fold, (rmse, r2) in enumerate(fold_metrics):
+        print(f"Fold {fold + 1} RMSE: {rmse:.4f}, R2: {r2:.4f}")
+    if args.histories:
+        with open(args.histories, 'w', encoding='utf-8') as f:
+            json.dump({'all_histories': all_histories, 'fold_metrics': fold_metrics}, f, indent=1)
+        print(f"Histories written to {args.histories}")
+
+
+if __name__ == "__main__":
+    main()
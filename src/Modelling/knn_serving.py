@@ -0,0 +1,322 @@
+"""
+Serving engine for the KNN sound-speed model (KNN_model.joblib, a Pipeline of
+StandardScaler and KNeighborsRegressor(n_neighbors=2) on a KD-tree).
+
+The pipeline's scaled training matrix, targets and KD-tree arrays are saved once as
+.npy files in <model>_index/ next to the model, and memory-mapped on load; queries go
+straight to the tree (no Pipeline / estimator validation per call) and large batches
+are split across threads, the tree query releasing the GIL. Predictions are the ones
+of KNN_model.joblib's predict(), bit for bit.
+
+For large grids there is an approximate mode: a forest of random-projection trees,
+built offline with the index, gives each query the training rows sharing its leaf in
+each tree, and the nearest of those candidates are used. Querying more trees is
+slower and closer to the exact answer; approximate_report() measures the trade-off.
+
+    python knn_serving.py --build
+    python knn_serving.py Train_data.parquet knn_predictions.parquet
+    python knn_serving.py grid.parquet knn_grid.parquet --approx 4
+    python knn_serving.py Train_data.parquet --report
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.neighbors import KDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from manifest import file_fingerprint, fingerprint_matches, save_npy, write_json
+from table_io import TableWriter
+from tree_state import restore_tree, tree_state
+from dnn_inference import iter_table_chunks
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KNN_MODEL = os.path.join(MODEL_DIR, 'KNN_model.joblib')
+
+# Bump whenever the files written by build_knn_index() change
+INDEX_VERSION = 2
+INDEX_META = 'index.json'
+# KD-tree arrays of sklearn's BinaryTree state (tree_state.TREE_STATE_ARRAYS), saved one .npy each
+TREE_ARRAYS = ('fit_X', 'idx_array', 'node_data', 'node_bounds')
+# Random-projection forest arrays, saved one .npy each
+FOREST_ARRAYS = ('rp_directions', 'rp_thresholds', 'rp_leaves')
+# Trees built, and the most training rows per leaf, of the approximate index
+RP_TREES = 16
+RP_LEAF_SIZE = 32
+# Batches smaller than this are queried on the calling thread
+MIN_ROWS_PER_THREAD = 2048
+# Query rows x candidates handled at once by the approximate search (bounds memory)
+CANDIDATE_BLOCK = 1 << 20
+
+PREDICTION_COLUMN = 'KNN'
+
+
+def index_dir_for(model_path):
+    """Folder the index of model_path is saved in: <model stem>_index next to the model."""
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + '_index')
+
+
+def build_rp_forest(X, n_trees=RP_TREES, leaf_size=RP_LEAF_SIZE, seed=0):
+    """
+    Random-projection forest over the rows of X: each tree splits every node at the
+    median of the node's rows projected on a random direction, down to leaves of at most
+    leaf_size rows. Trees are complete binary trees stored level by level (node i has
+    children 2i+1 and 2i+2); a query goes right when its projection exceeds the node's
+    threshold. Returns (directions (trees, nodes, features), thresholds (trees, nodes),
+    leaves (trees, 2**depth, rows per leaf) padded with len(X)).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, d = X.shape
+    depth = max(int(np.ceil(np.log2(n / leaf_size))), 0)
+    n_nodes = 2 ** depth - 1
+    rng = np.random.default_rng(seed)
+    directions = rng.standard_normal((n_trees, n_nodes, d))
+    thresholds = np.empty((n_trees, n_nodes))
+    width = -(-n // 2 ** depth)
+    leaves = np.full((n_trees, 2 ** depth, width), n, dtype=np.intp)
+    for tree in range(n_trees):
+        order = np.arange(n)
+        for level in range(depth):
+            # Rows order[bounds[j]:bounds[j + 1]] belong to node j of this level; the
+            # bounds of the next level nest inside them
+            first = 2 ** level - 1
+            bounds = np.arange(2 ** level + 1) * n // 2 ** level
+            node = np.repeat(np.arange(2 ** level), np.diff(bounds))
+            proj = np.einsum('ij,ij->i', X[order], directions[tree, first + node])
+            sort = np.lexsort((proj, node))
+            order, proj = order[sort], proj[sort]
+            split = (2 * np.arange(2 ** level) + 1) * n // 2 ** (level + 1)
+            thresholds[tree, first:first + 2 ** level] = (proj[split - 1] + proj[split]) / 2
+        bounds = np.arange(2 ** depth + 1) * n // 2 ** depth
+        for leaf, (a, b) in enumerate(zip(bounds[:-1], bounds[1:])):
+            leaves[tree, leaf, :b - a] = order[a:b]
+    return directions, thresholds, leaves
+
+
+def build_knn_index(model_path=DEFAULT_KNN_MODEL, index_dir=None, rp_trees=RP_TREES, rp_leaf_size=RP_LEAF_SIZE):
+    """
+    Save the scaler, targets and KD-tree of the KNN pipeline in model_path, and a
+    random-projection forest of rp_trees trees over its training rows, as .npy files
+    plus an index.json (model hash, tree parameters, sklearn version) in index_dir
+    (default: index_dir_for(model_path)). The JSON is written last. Returns index_dir.
+    """
+    import joblib
+    index_dir = Path(index_dir or index_dir_for(model_path))
+    index_dir.mkdir(parents=True, exist_ok=True)
+    (index_dir / INDEX_META).unlink(missing_ok=True)
+
+    pipeline = joblib.load(model_path)
+    scaler, knn = pipeline.named_steps['scaler'], pipeline.steps[-1][1]
+    if knn.weights != 'uniform' or knn._fit_method != 'kd_tree' or knn._y.ndim != 1:
+        raise ValueError("Only a single-output, uniform-weight KD-tree KNeighborsRegressor is supported")
+    tree_arrays, tree_params = tree_state(knn._tree)
+    arrays = dict(zip(TREE_ARRAYS, tree_arrays), y=knn._y, mean=scaler.mean_, scale=scaler.scale_)
+    arrays.update(zip(FOREST_ARRAYS, build_rp_forest(knn._fit_X, rp_trees, rp_leaf_size)))
+    for name, array in arrays.items():
+        save_npy(index_dir / f"{name}.npy", np.ascontiguousarray(array))
+
+    meta = {
+        'index_version': INDEX_VERSION,
+        'model': Path(model_path).name,
+        **file_fingerprint(model_path, prefix='model_'),
+        'sklearn_version': sklearn.__version__,
+        'features': [str(name) for name in getattr(scaler, 'feature_names_in_', [])],
+        'n_neighbors': int(knn.n_neighbors),
+        **tree_params,
+        'rp_trees': rp_trees,
+        'rp_leaf_size': rp_leaf_size,
+    }
+    write_json(index_dir / INDEX_META, meta)
+    return index_dir
+
+
+def _is_index_fresh(model_path, meta):
+    if meta is None or meta.get('index_version') != INDEX_VERSION:
+        return False
+    return fingerprint_matches(model_path, meta, prefix='model_', missing_ok=True)
+
+
+class KNNIndex:
+    """
+    Memory-mapped KD-tree serving engine for the KNN pipeline. Use KNNIndex.load(); the
+    index is built from the joblib model first if it is missing or out of date.
+    """
+
+    def __init__(self, index_dir, meta, workers=None):
+        arrays = {name: np.load(Path(index_dir) / f"{name}.npy", mmap_mode='r')
+                  for name in TREE_ARRAYS + FOREST_ARRAYS + ('y', 'mean', 'scale')}
+        self.meta = meta
+        self.features = meta['features'] or None
+        self.n_neighbors = meta['n_neighbors']
+        self.mean, self.scale, self.y = arrays['mean'], arrays['scale'], arrays['y']
+        # Plain ndarray views of the maps: fancy indexing a np.memmap is slower
+        self.rp_directions, self.rp_thresholds, self.rp_leaves = (np.asarray(arrays[name]) for name in FOREST_ARRAYS)
+        self._fit_X = arrays['fit_X']
+        self._padded = None
+        # The saved tree around the memory-mapped arrays (rebuilt under another sklearn)
+        self.tree = restore_tree(KDTree, [arrays[name] for name in TREE_ARRAYS], meta, meta['sklearn_version'])
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    @classmethod
+    def load(cls, model_path=DEFAULT_KNN_MODEL, index_dir=None, build=True, workers=None):
+        index_dir = Path(index_dir or index_dir_for(model_path))
+        meta = None
+        if (index_dir / INDEX_META).exists():
+            with open(index_dir / INDEX_META, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        if not _is_index_fresh(model_path, meta):
+            if not build:
+                raise FileNotFoundError(f"No up-to-date KNN index in {index_dir}")
+            build_knn_index(model_path, index_dir)
+            with open(index_dir / INDEX_META, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        return cls(index_dir, meta, workers)
+
+    def _as_matrix(self, X):
+        if isinstance(X, pd.DataFrame):
+            X = X[self.features].to_numpy() if self.features else X.to_numpy()
+        # StandardScaler.transform: (X - mean_) / scale_ on a float64 copy
+        X = np.array(X, dtype=np.float64, ndmin=2)
+        X -= self.mean
+        X /= self.scale
+        return X
+
+    def _query(self, X):
+        return self.tree.query(X, k=self.n_neighbors, return_distance=False)
+
+    def _map_slices(self, func, X):
+        """func over even row slices of X on the thread pool, results stacked."""
+        n_slices = min(self.workers, len(X) // MIN_ROWS_PER_THREAD)
+        if n_slices <= 1:
+            return func(X)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        bounds = np.linspace(0, len(X), n_slices + 1).astype(int)
+        parts = self._pool.map(func, [X[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+        return np.vstack(list(parts))
+
+    def _approximate_query(self, X, n_trees):
+        if self._padded is None:
+            # Training rows plus a row at infinity for the padding of the leaves, in float32:
+            # candidates are only ranked, and the gathers move half the bytes
+            self._padded = np.vstack([self._fit_X, np.full((1, self._fit_X.shape[1]), np.inf)]).astype(np.float32)
+        directions, thresholds = self.rp_directions[:n_trees], self.rp_thresholds[:n_trees]
+        depth = int(np.log2(self.rp_leaves.shape[1]))
+        trees = np.arange(n_trees)
+        node = np.zeros((len(X), n_trees), dtype=np.intp)
+        for _ in range(depth):
+            right = np.einsum('ij,itj->it', X, directions[trees, node]) > thresholds[trees, node]
+            node = 2 * node + 1 + right
+        leaf = node - (self.rp_leaves.shape[1] - 1)
+        candidates = np.sort(self.rp_leaves[trees, leaf].reshape(len(X), -1), axis=1)
+        n_out = np.empty((len(X), self.n_neighbors), dtype=np.intp)
+        step = max(CANDIDATE_BLOCK // candidates.shape[1], 1)
+        for a in range(0, len(X), step):
+            c = candidates[a:a + step]
+            diff = self._padded[c] - X[a:a + step, None, :].astype(np.float32)
+            dist = np.einsum('ikj,ikj->ik', diff, diff)
+            # A row found by several trees counts once
+            dist[:, 1:][c[:, 1:] == c[:, :-1]] = np.inf
+            nearest = np.argpartition(dist, self.n_neighbors - 1, axis=1)[:, :self.n_neighbors]
+            n_out[a:a + step] = np.take_along_axis(c, nearest, axis=1)
+        return n_out
+
+    def kneighbors(self, X, n_trees=None):
+        """
+        Indices of the n_neighbors training rows nearest to each row of X (unscaled
+        features): exact by default, or approximate over the first n_trees trees of the
+        random-projection forest.
+        """
+        X = self._as_matrix(X)
+        if n_trees is None:
+            return self._map_slices(self._query, X)
+        n_trees = min(max(int(n_trees), 1), len(self.rp_thresholds))
+        return self._map_slices(lambda part: self._approximate_query(part, n_trees), X)
+
+    def predict(self, X, n_trees=None):
+        """
+        Sound speed for each row of X. Exact (n_trees=None) predictions are identical to
+        the joblib pipeline's predict(X); with n_trees they are approximate.
+        """
+        return np.mean(self.y[self.kneighbors(X, n_trees)], axis=1)
+
+    def approximate_report(self, X, tree_counts=None):
+        """
+        Accuracy and speed of the approximate mode on X against the exact predictions (the
+        ones of KNN_model.joblib): one dict per number of trees with the recall of the
+        exact neighbours, RMSE and max absolute difference of the predictions (m/s), and
+        rows/s. The exact search comes first, with tree count None.
+        """
+        if tree_counts is None:
+            tree_counts = [2 ** i for i in range(int(np.log2(len(self.rp_thresholds))) + 1)]
+        start = time.perf_counter()
+        exact = np.sort(self.kneighbors(X), axis=1)
+        seconds = time.perf_counter() - start
+        expected = np.mean(self.y[exact], axis=1)
+        rows = [{'n_trees': None, 'recall': 1.0, 'rmse_delta': 0.0, 'max_delta': 0.0, 'rows_per_s': len(X) / seconds}]
+        for n_trees in tree_counts:
+            start = time.perf_counter()
+            found = np.sort(self.kneighbors(X, n_trees), axis=1)
+            seconds = time.perf_counter() - start
+            delta = np.mean(self.y[found], axis=1) - expected
+            recall = np.mean((found[:, :, None] == exact[:, None, :]).any(axis=2))
+            rows.append({'n_trees': n_trees, 'recall': float(recall), 'rmse_delta': float(np.sqrt(np.mean(delta ** 2))),
+                         'max_delta': float(np.max(np.abs(delta))), 'rows_per_s': len(X) / seconds})
+        return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="KNN serving engine: build the memory-mapped KD-tree index, or predict a CSV / Parquet file.")
+    parser.add_argument('input', type=str, nargs='?', default=None, help='CSV or Parquet file with the model features')
+    parser.add_argument('output', type=str, nargs='?', default=None, help='CSV or Parquet file: the input rows plus ' + PREDICTION_COLUMN)
+    parser.add_argument('--model', type=str, default=DEFAULT_KNN_MODEL, help='KNN pipeline (.joblib)')
+    parser.add_argument('--index_dir', type=str, default=None, help='Index folder (default: <model>_index next to the model)')
+    parser.add_argument('--build', action='store_true', help='(Re)build the index and exit if no input is given')
+    parser.add_argument('--workers', type=int, default=None, help='Query threads (default: one per CPU)')
+    parser.add_argument('--chunk_rows', type=int, default=1_000_000, help='Rows read from the input at a time')
+    parser.add_argument('--approx', type=int, default=None, metavar='N_TREES',
+                        help='Approximate neighbours from N_TREES random-projection trees (more: slower, closer to exact)')
+    parser.add_argument('--report', action='store_true',
+                        help='Print recall, RMSE delta vs the exact predictions and speed of the approximate mode on the input')
+    args = parser.parse_args()
+
+    if args.build:
+        print(f"KNN index written to {build_knn_index(args.model, args.index_dir)}")
+    if args.input is None:
+        if not args.build:
+            parser.error("give an input file, or --build")
+        return
+    if args.output is None and not args.report:
+        parser.error("give an output file, or --report")
+
+    start = time.perf_counter()
+    index = KNNIndex.load(args.model, args.index_dir, workers=args.workers)
+    print(f"Index loaded in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    if args.report:
+        df = next(iter_table_chunks(args.input, args.chunk_rows))
+        print(f"Approximate vs exact on the first {len(df)} rows of {args.input}:")
+        print(f"{'trees':>6} {'recall':>8} {'RMSE delta':>11} {'max delta':>10} {'rows/s':>12}")
+        for row in index.approximate_report(df):
+            print(f"{row['n_trees'] or 'exact':>6} {row['recall']:8.3f} {row['rmse_delta']:11.3f} "
+                  f"{row['max_delta']:10.3f} {row['rows_per_s']:12,.0f}")
+        if args.output is None:
+            return
+    start = time.perf_counter()
+    with TableWriter(args.output) as out:
+        for df in iter_table_chunks(args.input, args.chunk_rows):
+            out.write(df.assign(**{PREDICTION_COLUMN: index.predict(df, args.approx)}))
+        rows = out.rows
+    seconds = time.perf_counter() - start
+    print(f"{rows} rows in {seconds:.2f} s ({rows / seconds:,.0f} rows/s), predictions written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
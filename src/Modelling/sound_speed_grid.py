@@ -0,0 +1,243 @@
+"""
+Gridded sound-speed field: the chosen model (TEOS-10 direct, DNN or KNN) evaluated once,
+offline, on a regular latitude x longitude x depth grid and stored as a chunked,
+compressed NetCDF cube; maps and profiles are then slices of the cube with trilinear
+interpolation instead of model calls.
+
+The models need temperature and salinity, which a grid point does not have: the rows of
+the final table (read from its memory-mapped training cache) are binned to the nearest
+grid node and each node gets the mean CTDTMP and CTDSAL of its rows. Pressure, depth,
+SA and CT are then computed at the node itself, and the model evaluated there. Nodes
+with no observations are NaN in the cube; interpolation leaves them out and renormalizes
+the weights of the surrounding nodes that have data, so a point is only NaN when none of
+them does.
+
+    python sound_speed_grid.py Train_data.csv sound_speed_grid.nc --model teos10 \\
+        --lat -80 80 1 --lon -180 180 1 --depth 0 5000 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import gsw
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from conversion_functions import teos10_columns
+from training_cache import FEATURE_COLUMNS, load_training_cache
+
+GRID_MODELS = ("teos10", "dnn", "knn")
+# Rows of the training matrix binned at a time
+BIN_BLOCK_ROWS = 4_000_000
+# NetCDF chunk of the cube: a whole water column of up to CHUNK_NODES x CHUNK_NODES
+# positions, so a profile is read from one chunk
+CHUNK_NODES = 32
+COMPRESSION_LEVEL = 4
+
+
+def grid_axis(start, stop, step):
+    """Regular axis from start to stop (included when it falls on the grid) every step."""
+    return start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+
+
+def _node_index(values, axis):
+    """Nearest node of a regular axis for each value, -1 outside the axis."""
+    index = np.rint((values - axis[0]) / (axis[1] - axis[0] if len(axis) > 1 else 1.0))
+    index[~((index >= 0) & (index < len(axis)))] = -1
+    return index.astype(np.intp)
+
+
+def bin_observations(X, latitudes, longitudes, depths):
+    """
+    Mean CTDTMP and CTDSAL and number of rows per grid node of the rows of X (a training
+    matrix, FEATURE_COLUMNS), each row going to its nearest node. Returns three
+    (lat, lon, depth) arrays: temperature, salinity (NaN where no rows) and counts.
+    """
+    col = {name: FEATURE_COLUMNS.index(name) for name in ('LATITUDE', 'LONGITUDE', 'depth_m', 'CTDTMP', 'CTDSAL')}
+    shape = (len(latitudes), len(longitudes), len(depths))
+    n_nodes = int(np.prod(shape))
+    counts = np.zeros(n_nodes, dtype=np.int64)
+    t_sum = np.zeros(n_nodes)
+    s_sum = np.zeros(n_nodes)
+    for start in range(0, len(X), BIN_BLOCK_ROWS):
+        block = np.asarray(X[start:start + BIN_BLOCK_ROWS], dtype=np.float64)
+        i = _node_index(block[:, col['LATITUDE']], latitudes)
+        j = _node_index(block[:, col['LONGITUDE']], longitudes)
+        k = _node_index(block[:, col['depth_m']], depths)
+        inside = (i >= 0) & (j >= 0) & (k >= 0)
+        node = np.ravel_multi_index((i[inside], j[inside], k[inside]), shape)
+        counts += np.bincount(node, minlength=n_nodes)
+        t_sum += np.bincount(node, weights=block[inside, col['CTDTMP']], minlength=n_nodes)
+        s_sum += np.bincount(node, weights=block[inside, col['CTDSAL']], minlength=n_nodes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (t_sum / counts).reshape(shape), (s_sum / counts).reshape(shape), counts.reshape(shape)
+
+
+def node_features(lat, lon, depth, t, SP):
+    """Training matrix (FEATURE_COLUMNS) and TEOS-10 sound speed at nodes given as 1-D arrays."""
+    p = gsw.p_from_z(-depth, lat)
+    depth_m, SA, CT, c = teos10_columns(p, t, SP, lon, lat)
+    return np.column_stack([lat, lon, p, t, SP, depth_m, SA, CT]), c
+
+
+def evaluate_model(model, X, teos10_speed, approx_trees=None):
+    """Sound speed of the nodes with features X from `model` (one of GRID_MODELS)."""
+    if model == "teos10":
+        return teos10_speed
+    if model == "dnn":
+        from dnn_inference import DNNPredictor
+        return DNNPredictor().predict(X)
+    if model == "knn":
+        from knn_serving import KNNIndex
+        return KNNIndex.load().predict(X, approx_trees)
+    raise ValueError(f"Unknown model {model!r}; expected one of {GRID_MODELS}")
+
+
+def build_sound_speed_grid(table_path, output_path, latitudes, longitudes, depths, model="teos10",
+                           cache_dir=None, approx_trees=None):
+    """
+    Evaluate `model` on the grid of latitudes x longitudes x depths (regular 1-D axes,
+    degrees and metres) from the observations of the final table at table_path, and
+    write the cube to output_path (NetCDF). Returns the xarray Dataset.
+    """
+    X, _, meta = load_training_cache(table_path, cache_dir)
+    t, SP, counts = bin_observations(X, latitudes, longitudes, depths)
+
+    occupied = np.flatnonzero(counts.ravel())
+    i, j, k = np.unravel_index(occupied, counts.shape)
+    features, teos10_speed = node_features(latitudes[i], longitudes[j], depths[k], t.ravel()[occupied],
+                                           SP.ravel()[occupied])
+    ok = ~np.isnan(features).any(axis=1)
+    speed = np.full(counts.size, np.nan, dtype=np.float32)
+    speed[occupied[ok]] = evaluate_model(model, features[ok], teos10_speed[ok], approx_trees)
+
+    dims = ('latitude', 'longitude', 'depth')
+    ds = xr.Dataset(
+        {
+            'sound_speed': (dims, speed.reshape(counts.shape), {'units': 'm s-1'}),
+            'CTDTMP': (dims, t.astype(np.float32), {'units': 'degC', 'long_name': 'mean in-situ temperature'}),
+            'CTDSAL': (dims, SP.astype(np.float32), {'units': 'PSU', 'long_name': 'mean practical salinity'}),
+            'n_samples': (dims, counts.astype(np.int32), {'long_name': 'observations binned to the node'}),
+        },
+        coords={'latitude': latitudes, 'longitude': longitudes, 'depth': depths},
+        attrs={'model': model, 'source': meta['source'], 'source_sha256': meta['source_sha256']},
+    )
+    chunks = (min(CHUNK_NODES, len(latitudes)), min(CHUNK_NODES, len(longitudes)), len(depths))
+    encoding = {name: {'zlib': True, 'complevel': COMPRESSION_LEVEL, 'chunksizes': chunks} for name in ds.data_vars}
+    ds.to_netcdf(output_path, encoding=encoding)
+    return ds
+
+
+class SoundSpeedGrid:
+    """
+    A sound-speed cube written by build_sound_speed_grid(), held in memory. interpolate()
+    is trilinear on the regular grid, over the surrounding nodes that have data: nodes
+    never sampled (NaN) are skipped and the weights of the others rescaled to sum to 1.
+    A point outside the grid, or whose surrounding nodes are all unsampled, gets NaN.
+    """
+
+    def __init__(self, path):
+        with xr.open_dataset(path) as ds:
+            self.speed = ds['sound_speed'].values
+            self.axes = [ds[name].values for name in ('latitude', 'longitude', 'depth')]
+            self.attrs = dict(ds.attrs)
+        self.latitudes, self.longitudes, self.depths = self.axes
+
+    @staticmethod
+    def _locate(values, axis):
+        # Lower node and weight of the upper node along a regular axis
+        values = np.asarray(values, dtype=np.float64)
+        if len(axis) == 1:
+            inside = np.isclose(values, axis[0])
+            return np.zeros(values.shape, dtype=np.intp), np.zeros(values.shape), inside
+        position = (values - axis[0]) / (axis[1] - axis[0])
+        inside = (position >= 0) & (position <= len(axis) - 1)
+        lower = np.clip(np.floor(np.where(inside, position, 0)), 0, len(axis) - 2).astype(np.intp)
+        return lower, position - lower, inside
+
+    def interpolate(self, lat, lon, depth):
+        """Sound speed (m/s) at points given by broadcastable arrays of lat, lon and depth (m)."""
+        lat, lon, depth = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (lat, lon, depth)))
+        located = [self._locate(values, axis) for values, axis in zip((lat, lon, depth), self.axes)]
+        total = np.zeros(lat.shape)
+        weights = np.zeros(lat.shape)
+        for corner in range(8):
+            index, weight = [], 1.0
+            for dim, (lower, w, _) in enumerate(located):
+                upper = (corner >> dim) & 1
+                index.append(np.minimum(lower + upper, len(self.axes[dim]) - 1))
+                weight = weight * (w if upper else 1.0 - w)
+            value = self.speed[tuple(index)]
+            # Unsampled corners (and corners of weight 0, on a node or face) do not count
+            weight = np.where(np.isnan(value), 0.0, weight)
+            total += np.where(weight > 0, weight * value, 0.0)
+            weights += weight
+        inside = located[0][2] & located[1][2] & located[2][2]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(inside & (weights > 0), total / weights, np.nan)
+
+    def profile(self, lat, lon, depths=None):
+        """Sound-speed profile c(z) at (lat, lon), on the grid's depths unless depths (m) is given."""
+        if depths is not None:
+            return self.interpolate(lat, lon, depths)
+        # Bilinear between the four water columns around the point: slices of the cube
+        (i, wi, inside_lat), (j, wj, inside_lon) = (self._locate(v, axis) for v, axis in zip((lat, lon), self.axes[:2]))
+        if not (inside_lat and inside_lon):
+            return np.full(len(self.depths), np.nan)
+        total = np.zeros(len(self.depths))
+        weights = np.zeros(len(self.depths))
+        for di, w_lat in ((0, 1 - wi), (1, wi)):
+            for dj, w_lon in ((0, 1 - wj), (1, wj)):
+                if w_lat * w_lon > 0:
+                    column = self.speed[min(int(i) + di, len(self.latitudes) - 1),
+                                        min(int(j) + dj, len(self.longitudes) - 1)]
+                    sampled = ~np.isnan(column)
+                    total[sampled] += w_lat * w_lon * column[sampled]
+                    weights[sampled] += w_lat * w_lon
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(weights > 0, total / weights, np.nan)
+
+    def map(self, depth):
+        """
+        (latitude x longitude) sound-speed map at depth (m), linear between the two nearest
+        levels; where only one of them was sampled at a position, its value is used.
+        """
+        lower, w, inside = self._locate(depth, self.depths)
+        if not inside:
+            return np.full(self.speed.shape[:2], np.nan)
+        upper = min(int(lower) + 1, len(self.depths) - 1)
+        below = self.speed[:, :, int(lower)].astype(np.float64)
+        if w == 0:
+            return below
+        above = self.speed[:, :, upper].astype(np.float64)
+        out = (1 - w) * below + w * above
+        out = np.where(np.isnan(below), above, out)
+        return np.where(np.isnan(above), below, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute a gridded lat x lon x depth sound-speed cube from a final table.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet) with the observations, e.g. Train_data.csv')
+    parser.add_argument('output', type=str, help='NetCDF file for the cube')
+    parser.add_argument('--model', choices=GRID_MODELS, default="teos10", help='What computes the sound speed at the nodes')
+    parser.add_argument('--lat', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'), default=[-80, 80, 1])
+    parser.add_argument('--lon', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'), default=[-180, 180, 1])
+    parser.add_argument('--depth', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'), default=[0, 6000, 50],
+                        help='Depth levels, m')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Folder of the training-matrix cache (default: next to the table)')
+    parser.add_argument('--approx', type=int, default=None, metavar='N_TREES', help='With --model knn: approximate neighbours')
+    args = parser.parse_args()
+
+    axes = [grid_axis(*spec) for spec in (args.lat, args.lon, args.depth)]
+    start = time.perf_counter()
+    ds = build_sound_speed_grid(args.table, args.output, *axes, model=args.model, cache_dir=args.cache_dir,
+                                approx_trees=args.approx)
+    filled = int((ds['n_samples'] > 0).sum())
+    print(f"{args.model} grid {' x '.join(str(len(a)) for a in axes)} ({filled} nodes with data) "
+          f"written to {args.output} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
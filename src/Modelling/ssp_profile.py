@@ -0,0 +1,172 @@
+"""
+Sound-speed profile (SSP) queries: c(z) at a location, on any depth vector.
+
+A profile comes from the observed cast nearest to the location (station_index.py):
+the cast's rows are taken from the memory-mapped training cache and all its depths are
+evaluated in one vectorized call (TEOS-10, i.e. the table's sound_speed column, the
+DNN or the KNN model), then interpolated linearly onto the requested depths (NaN
+outside the depth range of the cast; the shallowest value is held up to the surface
+when it lies within one depth step of it, as the first pressure bin's mean does). Evaluated casts are cached by location rounded
+to `decimals` degrees, so repeated queries only cost the interpolation. For profiles
+at locations without nearby casts, see the gridded cube of sound_speed_grid.py.
+
+The table must keep several depths per cast: the pipeline's default aggregation
+(--group_keys CRUISE LATITUDE) reduces every station to one row, which cannot give a
+profile, and is rejected. Build it with pressure bins instead:
+
+    python Aggregator.py --zip_folder data --final_csv Train_data.csv \
+        --group_keys CRUISE LATITUDE PRS_BIN --pressure_bin 10
+
+    python ssp_profile.py Train_data.csv --near -55.0 72.9 --depth 0 2000 100 --model dnn
+"""
+import argparse
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from station_index import StationIndex, find_stations
+from training_cache import FEATURE_COLUMNS, load_training_cache
+
+PROFILE_MODELS = ("teos10", "dnn", "knn")
+DEPTH_COLUMN = FEATURE_COLUMNS.index('depth_m')
+
+
+class ProfileService:
+    """
+    Sound-speed profiles from the casts of a final table with several rows per cast
+    (pressure-binned, see the module docstring; ValueError otherwise). profile() answers
+    one location, profiles() many at once with a single model call for all the casts not
+    cached yet. Casts farther than max_radius_km from the (rounded) location give NaN
+    profiles.
+    """
+
+    def __init__(self, table_path, model="teos10", cache_dir=None, decimals=2, max_radius_km=100.0,
+                 cache_size=100_000):
+        if model not in PROFILE_MODELS:
+            raise ValueError(f"Unknown model {model!r}; expected one of {PROFILE_MODELS}")
+        self.X, self.y, _ = load_training_cache(table_path, cache_dir)
+        stations = StationIndex.load(table_path)
+        if stations.meta['rows'] != len(self.X):
+            # The cache dropped rows with NaNs: find the casts in its own row order
+            lat, lon = (self.X[:, FEATURE_COLUMNS.index(name)] for name in ('LATITUDE', 'LONGITUDE'))
+            stations = StationIndex(find_stations(lat, lon))
+        if len(stations.stations) and stations.stations['n_rows'].max() == 1:
+            raise ValueError(f"Every cast of {table_path} is a single row (the table was aggregated per station, "
+                             f"e.g. with Aggregator.py's default --group_keys CRUISE LATITUDE), so there is no "
+                             f"profile to interpolate; build it with --group_keys CRUISE LATITUDE PRS_BIN "
+                             f"--pressure_bin 10")
+        self.stations = stations
+        self.model = model
+        self._predictor = None
+        self.decimals = decimals
+        self.max_radius_km = max_radius_km
+        self.cache_size = cache_size
+        self._cache = OrderedDict()     # rounded (lat, lon) -> (depths, sound speed) of its cast
+
+    def _evaluate(self, X, rows):
+        if self.model == "teos10":
+            return np.asarray(self.y[rows], dtype=np.float64)
+        if self._predictor is None:
+            if self.model == "dnn":
+                from dnn_inference import DNNPredictor
+                self._predictor = DNNPredictor()
+            else:
+                from knn_serving import KNNIndex
+                self._predictor = KNNIndex.load()
+        return self._predictor.predict(X)
+
+    def _fill(self, keys):
+        """Evaluate the casts nearest to the rounded locations in keys and cache them."""
+        lat, lon = np.array(keys).T
+        cast, distance = self.stations.nearest_many(lat, lon, k=1)
+        cast, found = cast[:, 0], distance[:, 0] <= self.max_radius_km
+        stations = self.stations.stations[cast[found]]
+        rows = np.concatenate([np.arange(s['first_row'], s['first_row'] + s['n_rows']) for s in stations]
+                              + [np.empty(0, dtype=np.int64)])
+        X = np.asarray(self.X[rows], dtype=np.float64)
+        # All depths of all casts in one call
+        speed = self._evaluate(X, rows)
+        bounds = np.cumsum(np.concatenate([[0], stations['n_rows']]))
+        results = iter(range(len(stations)))
+        for key, ok in zip(keys, found):
+            if ok:
+                n = next(results)
+                depth, c = X[bounds[n]:bounds[n + 1], DEPTH_COLUMN], speed[bounds[n]:bounds[n + 1]]
+                order = np.argsort(depth, kind='stable')
+                depth, c = depth[order], c[order]
+                # The shallowest row of a binned cast is a bin mean a few metres down: hold
+                # its value up to the surface when it lies within one bin width of it
+                steps = np.diff(depth)
+                steps = steps[steps > 0]
+                if len(steps) and 0 < depth[0] <= np.median(steps):
+                    depth, c = np.concatenate([[0.0], depth]), np.concatenate([c[:1], c])
+                self._cache[key] = (depth, c)
+            else:
+                self._cache[key] = None
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _key(self, lat, lon):
+        return (round(float(lat), self.decimals), round(float(lon), self.decimals))
+
+    @staticmethod
+    def _interpolate(entry, depths):
+        if entry is None:
+            return np.full(len(depths), np.nan)
+        return np.interp(depths, entry[0], entry[1], left=np.nan, right=np.nan)
+
+    def profile(self, lat, lon, depths):
+        """Sound speed (m/s) at the depths (m, 1-D) of the water column at (lat, lon)."""
+        key = self._key(lat, lon)
+        if key not in self._cache:
+            self._fill([key])
+        self._cache.move_to_end(key)
+        return self._interpolate(self._cache[key], np.asarray(depths, dtype=np.float64))
+
+    def profiles(self, lat, lon, depths):
+        """Profiles at the locations of 1-D arrays lat and lon on one depth vector: (locations, depths)."""
+        keys = [self._key(a, b) for a, b in zip(lat, lon)]
+        missing = list(dict.fromkeys(key for key in keys if key not in self._cache))
+        if missing:
+            self._fill(missing)
+        depths = np.asarray(depths, dtype=np.float64)
+        out = np.empty((len(keys), len(depths)))
+        for n, key in enumerate(keys):
+            entry = self._cache.get(key)
+            if entry is None and key not in self._cache:
+                # Evicted by this batch itself (more locations than cache_size)
+                self._fill([key])
+                entry = self._cache[key]
+            out[n] = self._interpolate(entry, depths)
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sound-speed profile at a location from the nearest observed cast.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--near', type=float, nargs=2, metavar=('LAT', 'LON'), required=True, help='Location, degrees')
+    parser.add_argument('--depth', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'), default=[0, 1000, 50],
+                        help='Depths of the profile, m')
+    parser.add_argument('--model', choices=PROFILE_MODELS, default="teos10", help='What computes the sound speed')
+    parser.add_argument('--max_radius', type=float, default=100.0, help='Farthest cast used, km')
+    args = parser.parse_args()
+
+    service = ProfileService(args.table, args.model, max_radius_km=args.max_radius)
+    depths = np.arange(args.depth[0], args.depth[1] + args.depth[2] / 2, args.depth[2])
+    start = time.perf_counter()
+    c = service.profile(*args.near, depths)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    service.profile(*args.near, depths)
+    cached = time.perf_counter() - start
+    print(f"profile at {args.near[0]}, {args.near[1]}: {first * 1e3:.2f} ms, cached {cached * 1e3:.3f} ms")
+    for z, speed in zip(depths, c):
+        print(f"  {z:8.1f} m  {speed:9.3f} m/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from Aggregator import aggregate_frame, aggregate_frames
+
+
+def synthetic_shards(n_rows, n_shards, stations_per_shard, seed=0):
+    """Processed shards (LATITUDE, LONGITUDE, CTDPRS, CTDTMP, CTDSAL) with n_rows in total."""
+    rng = np.random.default_rng(seed)
+    rows_per_shard = n_rows // n_shards
+    shards = []
+    for _ in range(n_shards):
+        station = rng.integers(0, stations_per_shard, rows_per_shard)
+        lat = np.round(rng.uniform(-70, 70, stations_per_shard), 4)[station]
+        lon = np.round(rng.uniform(-180, 180, stations_per_shard), 4)[station]
+        prs = rng.uniform(0, 6000, rows_per_shard)
+        shards.append(pd.DataFrame({
+            'LATITUDE': lat,
+            'LONGITUDE': lon,
+            'CTDPRS': prs,
+            'CTDTMP': 25.0 - prs * 0.004 + rng.random(rows_per_shard),
+            'CTDSAL': 34.5 + rng.random(rows_per_shard),
+        }))
+    return shards
+
+
+def per_shard(shards):
+    """The original run_aggregator loop: one groupby per shard, then concat."""
+    return pd.concat([aggregate_frame(df) for df in shards], ignore_index=True)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: per-shard groupby loop vs one global group-by.")
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Total rows')
+    parser.add_argument('--shards', type=int, default=2000, help='Number of processed shards (zip files)')
+    parser.add_argument('--stations', type=int, default=40, help='Stations per shard')
+    args = parser.parse_args()
+
+    shards = synthetic_shards(args.rows, args.shards, args.stations)
+    old, t_old = timed(per_shard, shards)
+    new, t_new = timed(aggregate_frames, shards)
+    pd.testing.assert_frame_equal(old, new, check_exact=True)
+    print(f"rows={args.rows} shards={args.shards}")
+    print(f"  per-shard groupby loop : {t_old:7.2f} s")
+    print(f"  single global group-by : {t_new:7.2f} s  ({t_old / t_new:.1f}x)")
+
+    _, t_bin = timed(aggregate_frames, shards, ('CRUISE', 'LATITUDE', 'PRS_BIN'), 10.0)
+    print(f"  (cruise, lat, 10 dbar bin) group-by : {t_bin:7.2f} s")
+
+
+if __name__ == "__main__":
+    main()
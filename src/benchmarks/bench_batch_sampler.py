@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from training_cache import ShuffledBatches, load_training_cache
+
+
+def per_row_epoch(X, y, batch_size, rng):
+    """What DataLoader(TensorDataset, shuffle=True) does per batch: index every row, then stack."""
+    order = rng.permutation(len(X))
+    for start in range(0, len(X), batch_size):
+        rows = order[start:start + batch_size]
+        yield np.stack([X[i] for i in rows]), np.stack([y[i] for i in rows])
+
+
+def epoch_seconds(batches):
+    start = time.perf_counter()
+    for xb, yb in batches:
+        pass
+    return time.perf_counter() - start
+
+
+def best_epoch(epochs, n_epochs):
+    """Fastest of n_epochs epochs; epochs(epoch) gives the batches of one epoch."""
+    return min(epoch_seconds(epochs(epoch)) for epoch in range(n_epochs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Epoch time: pre-shuffled contiguous batches vs per-row indexing and collation.")
+    parser.add_argument('--table', type=str, default=None, help='Final table whose float32 training cache is used; '
+                                                                'synthetic rows in a temporary cache if omitted')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic rows')
+    parser.add_argument('--batch_divisor', type=float, default=457.76, help="Batch size = rows / this, as in DNN.ipynb")
+    parser.add_argument('--epochs', type=int, default=3, help='Epochs timed per method, the fastest is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.table:
+            X, y, _ = load_training_cache(args.table, dtype=np.float32)
+        else:
+            rng = np.random.default_rng(0)
+            np.save(os.path.join(tmp, 'X.npy'), rng.standard_normal((args.rows, 8), dtype=np.float32))
+            np.save(os.path.join(tmp, 'y.npy'), rng.standard_normal(args.rows, dtype=np.float32))
+            X, y = (np.load(os.path.join(tmp, name), mmap_mode='r') for name in ('X.npy', 'y.npy'))
+        batch_size = int(len(X) / args.batch_divisor)
+        print(f"{len(X)} rows x {X.shape[1]} ({X.dtype}), batch size {batch_size}")
+
+        # Every method is timed over the same number of epochs; one ShuffledBatches serves
+        # all its epochs, as in training
+        blocks = ShuffledBatches(X, y, batch_size, seed=0)
+        t_blocks = best_epoch(lambda epoch: blocks, args.epochs)
+        t_rows = best_epoch(lambda epoch: per_row_epoch(X, y, batch_size, np.random.default_rng(epoch)), args.epochs)
+        print(f"  per-row indexing + stack : {t_rows:8.3f} s/epoch")
+        print(f"  ShuffledBatches          : {t_blocks:8.3f} s/epoch")
+
+        try:
+            import torch
+            from torch.utils.data import DataLoader, TensorDataset
+        except ImportError:
+            print("  (torch not installed: DataLoader not measured)")
+            return
+        Xt, yt = torch.from_numpy(np.array(X)), torch.from_numpy(np.array(y))
+        loader = DataLoader(TensorDataset(Xt, yt), batch_size=batch_size, shuffle=True)
+        t_loader = best_epoch(lambda epoch: loader, args.epochs)
+        tensor_blocks = ShuffledBatches(X, y, batch_size, seed=0, convert=torch.from_numpy)
+        t_torch = best_epoch(lambda epoch: tensor_blocks, args.epochs)
+        print(f"  DataLoader(TensorDataset): {t_loader:8.3f} s/epoch")
+        print(f"  ShuffledBatches (tensors): {t_torch:8.3f} s/epoch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Modelling'))
+from dnn_inference import BATCHNORM_EPS, DEFAULT_SCALER, DEFAULT_WEIGHTS, DNNPredictor, load_scaler, load_state_dict
+
+
+def unfused_forward(state_dict, mean, scale, X, prefix='fc'):
+    """The network layer by layer in float32, as nn.Sequential does in eval mode after the StandardScaler."""
+    x = ((X - mean) / scale).astype(np.float32)
+    indices = sorted({int(name.split('.')[1]) for name in state_dict})
+    for i in range(indices[-1] + 1):
+        key = f"{prefix}.{i}."
+        if key + 'running_mean' in state_dict:
+            x = ((x - state_dict[key + 'running_mean']) / np.sqrt(state_dict[key + 'running_var'] + np.float32(BATCHNORM_EPS))
+                 * state_dict[key + 'weight'] + state_dict[key + 'bias'])
+        elif key + 'weight' in state_dict:
+            x = x @ state_dict[key + 'weight'].T + state_dict[key + 'bias']
+        else:
+            x = np.maximum(x, 0)
+    return x[:, 0].astype(np.float64)
+
+
+def synthetic_features(n_rows, mean, scale, seed=0):
+    """Rows drawn around the training distribution (the scaler's mean and scale)."""
+    rng = np.random.default_rng(seed)
+    return mean + scale * rng.standard_normal((n_rows, len(mean)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and throughput: fused DNN inference vs the layer-by-layer network.")
+    parser.add_argument('--rows', type=int, default=500_000, help='Rows to predict')
+    parser.add_argument('--batch_size', type=int, default=65536, help='Rows per forward pass')
+    args = parser.parse_args()
+
+    state_dict = load_state_dict(DEFAULT_WEIGHTS)
+    mean, scale, _ = load_scaler(DEFAULT_SCALER)
+    X = synthetic_features(args.rows, mean, scale)
+
+    start = time.perf_counter()
+    reference = np.concatenate([unfused_forward(state_dict, mean, scale, X[i:i + args.batch_size])
+                                for i in range(0, len(X), args.batch_size)])
+    t_ref = time.perf_counter() - start
+
+    predictor = DNNPredictor(batch_size=args.batch_size)
+    start = time.perf_counter()
+    fused = predictor.predict(X)
+    t_fused = time.perf_counter() - start
+
+    print(f"rows={args.rows}, max |fused - layer-by-layer| = {np.max(np.abs(fused - reference)):.2e} m/s")
+    print(f"  layer-by-layer: {args.rows / t_ref:12,.0f} rows/s")
+    print(f"  fused         : {args.rows / t_fused:12,.0f} rows/s")
+    print(f"  {predictor.report(args.rows, t_fused)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Modelling'))
+from knn_serving import DEFAULT_KNN_MODEL, KNNIndex, build_knn_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy vs speed of the approximate KNN mode against KNN_model.joblib.")
+    parser.add_argument('--rows', type=int, default=100_000, help='Query rows')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Noise added to training rows to make the queries, in standard deviations of each feature')
+    parser.add_argument('--trees', type=int, default=16, help='Trees built in the forest')
+    args = parser.parse_args()
+
+    import joblib
+    warnings.filterwarnings('ignore', category=UserWarning)   # sklearn version of the pickle
+    pipeline = joblib.load(DEFAULT_KNN_MODEL)
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        build_knn_index(DEFAULT_KNN_MODEL, index_dir, rp_trees=args.trees)
+        print(f"index with {args.trees} trees built in {time.perf_counter() - start:.2f} s")
+        index = KNNIndex.load(DEFAULT_KNN_MODEL, index_dir)
+
+        scaler, fit_X = pipeline.named_steps['scaler'], pipeline.steps[-1][1]._fit_X
+        rng = np.random.default_rng(0)
+        scaled = fit_X[rng.integers(0, len(fit_X), args.rows)] + args.jitter * rng.standard_normal((args.rows, fit_X.shape[1]))
+        X = scaler.inverse_transform(scaled)
+
+        start = time.perf_counter()
+        expected = pipeline.predict(X)
+        print(f"KNN_model.joblib: {args.rows / (time.perf_counter() - start):,.0f} rows/s")
+        print(f"{'trees':>6} {'recall':>8} {'RMSE delta':>11} {'max delta':>10} {'rows/s':>12}")
+        for row in index.approximate_report(X):
+            print(f"{row['n_trees'] or 'exact':>6} {row['recall']:8.3f} {row['rmse_delta']:11.3f} "
+                  f"{row['max_delta']:10.3f} {row['rows_per_s']:12,.0f}")
+        print(f"exact mode identical to KNN_model.joblib: {np.array_equal(index.predict(X), expected)}")
+
+
+if __name__ == "__main__":
+    main()
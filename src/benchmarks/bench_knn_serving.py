@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Modelling'))
+from knn_serving import DEFAULT_KNN_MODEL, KNNIndex, build_knn_index
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency: memory-mapped KD-tree serving vs the joblib KNN pipeline.")
+    parser.add_argument('--rows', type=int, default=200_000, help='Rows of the throughput batch')
+    parser.add_argument('--repeat', type=int, default=200, help='Repetitions of each small query')
+    parser.add_argument('--workers', type=int, default=None, help='Query threads (default: one per CPU)')
+    args = parser.parse_args()
+
+    import joblib
+    warnings.filterwarnings('ignore', category=UserWarning)   # sklearn version of the pickle
+    pipeline, t_joblib = timed(lambda: joblib.load(DEFAULT_KNN_MODEL), 1)
+    with tempfile.TemporaryDirectory() as index_dir:
+        build_knn_index(DEFAULT_KNN_MODEL, index_dir)
+        index, t_index = timed(lambda: KNNIndex.load(DEFAULT_KNN_MODEL, index_dir, workers=args.workers), 1)
+        scaler = pipeline.named_steps['scaler']
+        rng = np.random.default_rng(0)
+        X = scaler.mean_ + scaler.scale_ * rng.standard_normal((args.rows, len(scaler.mean_)))
+        # Training rows too, where ties between equidistant neighbours are most likely
+        X[:1000] = scaler.inverse_transform(pipeline.steps[-1][1]._fit_X[:1000])
+
+        print(f"load: joblib {t_joblib * 1e3:.1f} ms, index {t_index * 1e3:.1f} ms")
+        for n in (1, 100):
+            _, t_pipe = timed(lambda: pipeline.predict(X[:n]), args.repeat)
+            _, t_serve = timed(lambda: index.predict(X[:n]), args.repeat)
+            print(f"{n:>6} rows: pipeline {t_pipe * 1e3:8.3f} ms, index {t_serve * 1e3:8.3f} ms")
+        expected, t_pipe = timed(lambda: pipeline.predict(X), 1)
+        served, t_serve = timed(lambda: index.predict(X), 1)
+        print(f"{args.rows:>6} rows: pipeline {args.rows / t_pipe:10,.0f} rows/s, index {args.rows / t_serve:10,.0f} rows/s")
+        print(f"identical predictions: {np.array_equal(expected, served)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+
+import gsw
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from conversion_functions import memoized_saar, teos10_columns
+
+
+def repeat_occupations(n_sites, occupations, levels, seed=0):
+    """Casts on a fixed pressure grid, each site occupied `occupations` times."""
+    rng = np.random.default_rng(seed)
+    lat = np.repeat(np.tile(rng.uniform(-70, 70, n_sites), occupations), levels)
+    lon = np.repeat(np.tile(rng.uniform(0, 360, n_sites), occupations), levels)
+    p = np.tile(np.arange(levels) * 2.0 + 1.0, n_sites * occupations)
+    t = 25.0 - p * 0.004 + rng.random(len(p))
+    SP = 34.5 + rng.random(len(p))
+    return p, t, SP, lon, lat
+
+
+def best_of(fn, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return out, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: per-row vs memoized SAAR lookup.")
+    parser.add_argument('--sites', type=int, default=50, help='Distinct station positions')
+    parser.add_argument('--levels', type=int, default=1000, help='Pressure levels per cast')
+    parser.add_argument('--occupations', type=int, nargs='+', default=[1, 5, 20],
+                        help='Casts per site (one benchmark row each)')
+    args = parser.parse_args()
+
+    for occupations in args.occupations:
+        p, t, SP, lon, lat = repeat_occupations(args.sites, occupations, args.levels)
+        saar, t_saar = best_of(lambda: gsw.SAAR(p, lon, lat))
+        memo, t_memo = best_of(lambda: memoized_saar(p, lon, lat))
+        direct, t_chain = best_of(lambda: teos10_columns(p, t, SP, lon, lat, workers=1))
+        memo_cols, t_chain_memo = best_of(lambda: teos10_columns(p, t, SP, lon, lat, workers=1, memoize_saar=True))
+        assert np.array_equal(saar, memo)
+        for a, b in zip(direct, memo_cols):
+            assert np.array_equal(a, b)
+        print(f"rows={len(p)}, occupations={occupations}")
+        print(f"  SAAR      per row: {t_saar:6.3f} s   memoized: {t_memo:6.3f} s")
+        print(f"  TEOS-10   per row: {t_chain:6.3f} s   memoized: {t_chain_memo:6.3f} s")
+
+
+if __name__ == "__main__":
+    main()
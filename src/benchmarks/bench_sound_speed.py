@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from conversion_functions import SOUND_SPEED_METHODS, compute_sound_speed
+from table_io import read_table
+
+
+def synthetic_profiles(n_rows, seed=0):
+    """Ocean-like rows: temperature falling and salinity settling with pressure."""
+    rng = np.random.default_rng(seed)
+    prs = rng.uniform(0, 6000, n_rows)
+    return pd.DataFrame({
+        'LATITUDE': rng.uniform(-70, 70, n_rows),
+        'LONGITUDE': rng.uniform(-180, 180, n_rows),
+        'CTDPRS': prs,
+        'CTDTMP': 2.0 + 25.0 * np.exp(-prs / 800.0) + rng.normal(0, 0.5, n_rows),
+        'CTDSAL': 34.7 + 0.8 * np.exp(-prs / 500.0) * rng.uniform(-1, 1, n_rows),
+    })
+
+
+def best_of(fn, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return out, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: sound-speed polynomials vs TEOS-10 (gsw), accuracy and throughput.")
+    parser.add_argument('--train_csv', type=str, default=None,
+                        help='Training table (CSV or Parquet) with CTDPRS, CTDTMP, CTDSAL, LATITUDE, LONGITUDE; '
+                             'synthetic profiles if omitted')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Rows in the synthetic input')
+    args = parser.parse_args()
+
+    if args.train_csv:
+        df = read_table(args.train_csv).dropna()
+        print(f"{args.train_csv}: {len(df)} rows")
+    else:
+        df = synthetic_profiles(args.rows)
+        print(f"synthetic profiles: {len(df)} rows")
+    inputs = [df[col].to_numpy(dtype=np.float64) for col in ('CTDPRS', 'CTDTMP', 'CTDSAL', 'LONGITUDE', 'LATITUDE')]
+
+    reference, t_ref = best_of(lambda: compute_sound_speed(*inputs, method="teos10"))
+    print(f"{'method':>13} {'time (s)':>9} {'Mrows/s':>8} {'mean err':>9} {'RMSE':>7} {'max |err|':>9}  (m/s vs teos10)")
+    for method in SOUND_SPEED_METHODS:
+        c, t = best_of(lambda: compute_sound_speed(*inputs, method=method))
+        err = c - reference
+        print(f"{method:>13} {t:9.3f} {len(c) / t / 1e6:8.1f} {np.mean(err):9.3f} "
+              f"{np.sqrt(np.mean(err ** 2)):7.3f} {np.max(np.abs(err)):9.3f}")
+
+
+if __name__ == "__main__":
+    main()
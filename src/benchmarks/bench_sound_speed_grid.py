@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Modelling'))
+from sound_speed_grid import SoundSpeedGrid, build_sound_speed_grid, grid_axis, node_features
+from dnn_inference import DNNPredictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile latency: gridded sound-speed cube vs calling the DNN per profile.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--model', type=str, default="dnn", help='Model the cube is built with')
+    parser.add_argument('--profiles', type=int, default=2000, help='Profiles to look up')
+    args = parser.parse_args()
+
+    latitudes, longitudes, depths = grid_axis(-70, 70, 1), grid_axis(-180, 180, 1), grid_axis(0, 5000, 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'grid.nc')
+        start = time.perf_counter()
+        build_sound_speed_grid(args.table, path, latitudes, longitudes, depths, model=args.model)
+        print(f"{args.model} cube {len(latitudes)} x {len(longitudes)} x {len(depths)} built in "
+              f"{time.perf_counter() - start:.1f} s, {os.path.getsize(path) / 1e6:.1f} MB")
+        start = time.perf_counter()
+        grid = SoundSpeedGrid(path)
+        print(f"cube loaded in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(-70, 70, args.profiles), rng.uniform(-180, 180, args.profiles)
+    start = time.perf_counter()
+    for a, b in zip(lat, lon):
+        grid.profile(a, b)
+    t_grid = (time.perf_counter() - start) / args.profiles
+
+    # The model per profile, on a fixed temperature/salinity column (inputs the cube already has)
+    predictor = DNNPredictor()
+    t, SP = 2.0 + 25.0 * np.exp(-depths / 800.0), np.full(len(depths), 34.7)
+    start = time.perf_counter()
+    for a, b in zip(lat, lon):
+        X, _ = node_features(np.full(len(depths), a), np.full(len(depths), b), depths, t, SP)
+        predictor.predict(X)
+    t_model = (time.perf_counter() - start) / args.profiles
+    print(f"{len(depths)}-level profile: cube {t_grid * 1e3:.3f} ms, features + DNN {t_model * 1e3:.3f} ms")
+    print(f"map slice at 1000 m: {grid.map(1000).shape}")
+
+
+if __name__ == "__main__":
+    main()
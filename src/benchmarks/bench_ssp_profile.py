@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Modelling'))
+from ssp_profile import DEPTH_COLUMN, PROFILE_MODELS, ProfileService
+
+
+def check_casts(table, n_casts=200, seed=0):
+    """Profiles at the casts' own positions and depths must give the table's sound_speed back."""
+    service = ProfileService(table, "teos10", decimals=6)
+    stations = service.stations.stations
+    rng = np.random.default_rng(seed)
+    for s in stations[rng.choice(len(stations), min(n_casts, len(stations)), replace=False)]:
+        rows = slice(s['first_row'], s['first_row'] + s['n_rows'])
+        depths, expected = service.X[rows, DEPTH_COLUMN], service.y[rows]
+        np.testing.assert_allclose(service.profile(s['latitude'], s['longitude'], depths), expected)
+    print(f"{min(n_casts, len(stations))} casts of {len(stations)}: profiles match the table "
+          f"(median {int(np.median(stations['n_rows']))} depths per cast)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profiles per second of the SSP API, first (model call) and cached.")
+    parser.add_argument('table', type=str, help='Final table (CSV or Parquet), e.g. Train_data.csv')
+    parser.add_argument('--locations', type=int, default=5000, help='Random locations queried')
+    parser.add_argument('--max_radius', type=float, default=300.0, help='Farthest cast used, km')
+    args = parser.parse_args()
+
+    check_casts(args.table)
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(-70, 70, args.locations), rng.uniform(-180, 180, args.locations)
+    depths = np.arange(0, 2000, 10.0)
+    for model in PROFILE_MODELS:
+        service = ProfileService(args.table, model, max_radius_km=args.max_radius)
+        start = time.perf_counter()
+        first = service.profiles(lat, lon, depths)
+        t_first = time.perf_counter() - start
+        start = time.perf_counter()
+        for a, b in zip(lat, lon):
+            service.profile(a, b, depths)
+        t_cached = time.perf_counter() - start
+        print(f"{model:>7}: batch of {args.locations} new locations {args.locations / t_first:10,.0f} profiles/s, "
+              f"cached single queries {args.locations / t_cached:10,.0f} profiles/s "
+              f"({t_cached / args.locations * 1e3:.3f} ms), {np.isnan(first).all(axis=1).mean():.0%} without a cast, "
+              f"{np.isnan(first).mean():.0%} NaN values")
+
+
+if __name__ == "__main__":
+    main()
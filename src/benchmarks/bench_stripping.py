@@ -0,0 +1,138 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+import ZipStrippor
+from ZipStrippor import stripping
+
+# Data blocks the readers must agree on (None: both must raise)
+EDGE_CASES = {
+    'crlf': ("1.0,2.5,34.1\r\n2.0,2.4,34.2\r\n", True),
+    'blank line': ("1.0,2.5,34.1\n\n2.0,2.4,34.2\n", True),
+    'blanks-only line': ("1.0,2.5,34.1\n \t \n2.0,2.4,34.2\n", True),
+    'comment line': ("1.0,2.5,34.1\n# note\n2.0,2.4,34.2\n", True),
+    'indented comment': ("1.0,2.5,34.1\n  # note\n2.0,2.4,34.2\n", True),
+    'tab-indented comment': ("1.0,2.5,34.1\n\t# note\n2.0,2.4,34.2\n", True),
+    'empty fields': ("1.0,,34.1\n2.0,2.4,\n", True),
+    'short row': ("1.0,2.5\n2.0,2.4,34.2\n", True),
+    'blanks and exponents': ("  1e3, 2.5E-1 ,+34.1\n-0,0.0001,-9\n", True),
+    'trailing comma': ("1.0,2.5,34.1,\n2.0,2.4,34.2,\n", None),
+    'extra value': ("1.0,2.5,34.1\n2.0,2.4,34.2,7\n", None),
+}
+
+
+def check_edge_cases(temp_dir):
+    """stripping() against the line-by-line reader on EDGE_CASES, with and without the compiled parser."""
+    parsers = [('numpy / pandas', False)]
+    if ZipStrippor._compiled_parser():
+        parsers.insert(0, ('compiled', ZipStrippor._compiled_parser()))
+    for name, (block, parses) in EDGE_CASES.items():
+        path = os.path.join(temp_dir, 'edge_ct1.csv')
+        with open(path, 'w', newline='') as f:
+            f.write("CTD,20010101WHPOSITS\nLATITUDE = -55.0440\nLONGITUDE = 72.9308\n"
+                    "CTDPRS,CTDTMP,CTDSAL\nDBAR,ITS-90,PSS-78\n" + block + "END_DATA\n")
+        for label, kernel in parsers:
+            ZipStrippor._parse_kernel = kernel
+            if parses:
+                pd.testing.assert_frame_equal(stripping_linewise(path).astype(np.float64),
+                                              stripping(path).astype(np.float64), check_exact=True)
+            else:
+                for reader in (stripping_linewise, stripping):
+                    try:
+                        reader(path)
+                    except ValueError:
+                        continue
+                    raise AssertionError(f"{reader.__name__} accepted the {name!r} block with {label}")
+    ZipStrippor._parse_kernel = None
+    print(f"{len(EDGE_CASES)} edge cases agree with the line-by-line reader ({', '.join(p for p, _ in parsers)})")
+
+
+def stripping_linewise(filepath):
+    """The original line-by-line reader, kept here as the reference for parity and timing."""
+    lat = None
+    lon = None
+    header = None
+    data_lines = []
+    found_lat = False
+    found_header = False
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if not found_lat:
+            if line.startswith('LATITUDE'):
+                lat = float(line.split('=')[1].strip(','))
+                i += 1
+                lon_line = lines[i].strip()
+                if lon_line.startswith('LONGITUDE'):
+                    lon = float(lon_line.split('=')[1].strip(','))
+                found_lat = True
+        elif not found_header:
+            if line.startswith('CTDPRS'):
+                header = ['LATITUDE', 'LONGITUDE'] + line.split(',')
+                found_header = True
+                i += 1
+        elif found_header:
+            if line.startswith('END_DATA'):
+                break
+            if line and not line.startswith('#'):
+                values = line.split(',')
+                data_lines.append([lat, lon] + [float(v) if v else None for v in values])
+        i += 1
+
+    return pd.DataFrame(data_lines, columns=header)
+
+
+def synthetic_ctd_file(path, n_rows, seed=0):
+    """Writes a WOCE exchange style *_ct1.csv with n_rows data rows."""
+    rng = np.random.default_rng(seed)
+    p = np.arange(n_rows) * 2.0 + 1.0
+    t = 25.0 - p * 0.005 + rng.random(n_rows)
+    s = 34.5 + rng.random(n_rows)
+    with open(path, 'w') as f:
+        f.write("CTD,20010101WHPOSITS\n# synthetic cast\nNUMBER_HEADERS = 4\nEXPOCODE = 00000000_1\n")
+        f.write(f"LATITUDE = {rng.uniform(-70, 70):.4f}\nLONGITUDE = {rng.uniform(-180, 180):.4f}\n")
+        f.write("CTDPRS,CTDPRS_FLAG_W,CTDTMP,CTDTMP_FLAG_W,CTDSAL,CTDSAL_FLAG_W\n")
+        f.write("DBAR,,ITS-90,,PSS-78,\n")
+        for row in zip(p, t, s):
+            f.write("%8.1f,2,%9.4f,2,%9.4f,2\n" % row)
+        f.write("END_DATA\n")
+
+
+def best_of(fn, path, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark: line-by-line vs vectorized WOCE CTD parsing.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000, 50000], help='Data rows per file')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions, best time is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_edge_cases(temp_dir)
+        for n_rows in args.rows:
+            path = os.path.join(temp_dir, f"{n_rows}_ct1.csv")
+            synthetic_ctd_file(path, n_rows)
+            pd.testing.assert_frame_equal(stripping_linewise(path), stripping(path), check_exact=True)
+            old = best_of(stripping_linewise, path, args.repeat)
+            new = best_of(stripping, path, args.repeat)
+            print(f"rows={n_rows:>7}  line-by-line={old * 1e3:9.2f} ms  vectorized={new * 1e3:9.2f} ms  speedup={old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import gsw
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from conversion_functions import apply_teos10
+
+
+def apply_teos10_per_column(df):
+    """The original filtering: one isin() filter per column, dropna, then a copy."""
+    invalids = [-999, -9999, 9999, 99999]
+    for col in ["CTDPRS", "CTDTMP", "CTDSAL", "LATITUDE", "LONGITUDE"]:
+        df = df[~df[col].isin(invalids)]
+    df = df.dropna(subset=["CTDPRS", "CTDTMP", "CTDSAL", "LATITUDE", "LONGITUDE"])
+
+    p = df["CTDPRS"].to_numpy()
+    t = df["CTDTMP"].to_numpy()
+    SP = df["CTDSAL"].to_numpy()
+    lat = df["LATITUDE"].to_numpy()
+    lon = df["LONGITUDE"].to_numpy()
+
+    depth_m = -gsw.z_from_p(p, lat)
+    SA = gsw.SA_from_SP(SP, p, lon, lat)
+    CT = gsw.CT_from_t(SA, t, p)
+    c = gsw.sound_speed(SA, CT, p)
+
+    df = df.copy()
+    df["depth_m"] = depth_m
+    df["SA"] = SA
+    df["CT"] = CT
+    df["sound_speed"] = c
+    return df
+
+
+def synthetic_ctd(n_rows, bad_fraction=0.01, seed=0):
+    """Aggregated-style CTD rows with a fraction of NaNs and sentinel values."""
+    rng = np.random.default_rng(seed)
+    prs = rng.uniform(0, 6000, n_rows)
+    df = pd.DataFrame({
+        'LATITUDE': rng.uniform(-70, 70, n_rows),
+        'LONGITUDE': rng.uniform(-180, 180, n_rows),
+        'CTDPRS': prs,
+        'CTDTMP': 25.0 - prs * 0.004 + rng.random(n_rows),
+        'CTDSAL': 34.5 + rng.random(n_rows),
+    })
+    for col in df.columns:
+        bad = rng.random(n_rows) < bad_fraction / len(df.columns)
+        df.loc[bad, col] = rng.choice([np.nan, -999.0, -9999.0], bad.sum())
+    return df
+
+
+def timed(fn, df):
+    start = time.perf_counter()
+    out = fn(df)
+    return out, time.perf_counter() - start
+
+
+def peak_memory(fn, df):
+    """Peak bytes allocated while running fn(df), beyond what was allocated before."""
+    tracemalloc.start()
+    fn(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark: apply_teos10 row filtering, time and peak memory.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Rows in the synthetic input')
+    args = parser.parse_args()
+
+    df = synthetic_ctd(args.rows)
+    old, t_old = timed(apply_teos10_per_column, df)
+    new, t_new = timed(apply_teos10, df)
+    # Measured in separate runs: tracemalloc slows down pandas' many small allocations
+    m_old = peak_memory(apply_teos10_per_column, df)
+    m_new = peak_memory(apply_teos10, df)
+    pd.testing.assert_frame_equal(old, new, check_exact=True)
+    print(f"rows={args.rows}, kept={len(new)}")
+    print(f"  per-column filters : {t_old:6.2f} s  peak {m_old / 2**20:8.1f} MiB")
+    print(f"  fused mask         : {t_new:6.2f} s  peak {m_new / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
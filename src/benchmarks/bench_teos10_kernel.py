@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DataCreation'))
+from conversion_functions import teos10_columns
+
+
+def random_casts(n_rows, nan_fraction=0.01, seed=0):
+    """Global random inputs, including out-of-range and NaN values, for the parity check."""
+    rng = np.random.default_rng(seed)
+    columns = [
+        rng.uniform(0, 8000, n_rows),       # p
+        rng.uniform(-2, 30, n_rows),        # t
+        rng.uniform(0, 42, n_rows),         # SP
+        rng.uniform(-180, 360, n_rows),     # lon
+        rng.uniform(-90, 90, n_rows),       # lat
+    ]
+    for values in columns:
+        values[rng.random(n_rows) < nan_fraction] = np.nan
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and timing: fused numba TEOS-10 kernel vs the gsw ufuncs.")
+    parser.add_argument('--rows', type=int, default=2_000_000, help='Rows in the random input')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Largest allowed absolute difference')
+    args = parser.parse_args()
+
+    columns = random_casts(args.rows)
+    teos10_columns(*(c[:1000] for c in columns), kernel="numba")    # compile outside the timing
+
+    start = time.perf_counter()
+    reference = teos10_columns(*columns, kernel="gsw")
+    t_gsw = time.perf_counter() - start
+    start = time.perf_counter()
+    fused = teos10_columns(*columns, kernel="numba")
+    t_numba = time.perf_counter() - start
+
+    print(f"rows={args.rows}")
+    for name, ref, out in zip(("depth_m", "SA", "CT", "sound_speed"), reference, fused):
+        assert np.array_equal(np.isnan(ref), np.isnan(out)), f"{name}: NaNs differ"
+        diff = np.nanmax(np.abs(ref - out))
+        assert diff <= args.tolerance, f"{name}: max |diff| {diff:g} > {args.tolerance:g}"
+        print(f"  {name:12s} max |diff| {diff:g}")
+    print(f"  gsw ufuncs : {t_gsw:6.3f} s")
+    print(f"  numba fused: {t_numba:6.3f} s")
+
+
+if __name__ == "__main__":
+    main()